@@ -0,0 +1,244 @@
+from io import BytesIO
+
+from PIL import Image, ImageChops, features
+
+
+class AnimationEncoder():
+    """
+    Base of the animated image writers
+
+    An encoder turns weather landscape frames (RGB or palette images carrying
+    their duration in info["duration"]) into one animated file. Subclasses set
+    FORMAT, EXT and MIME and implement Write().
+    """
+
+    FORMAT = None   # name used to select the encoder, e.g. "gif"
+    EXT = None      # file extension, e.g. ".gif"
+    MIME = None     # HTTP content type, e.g. "image/gif"
+
+    COLORS_MAX = 255    # one palette index is kept for transparency
+
+
+    def __init__(self, duration:int, loop:int=0):
+        """
+        Parameters:
+            duration: int - duration of frames without info["duration"], in milliseconds
+            loop: int - number of loops, 0 loops forever
+        """
+        self.duration = duration
+        self.loop = loop
+        self.encoded_size = 0
+        self.encoded_frames = 0
+
+
+    @classmethod
+    def Available(cls)->bool:
+        """Whether the installed Pillow can write this format"""
+        return True
+
+
+    def Durations(self, frames:list)->list:
+        """Duration of every frame in milliseconds"""
+        return [frame.info.get("duration", self.duration) for frame in frames]
+
+
+    def SharedPalette(self, frames:list)->list:
+        """
+        Make the palette shared by all frames
+
+        Frames drawn with the Sprites colors use a few dozen colors at most and get
+        an exact palette. Frames with more colors (e.g. a resized moon overlay)
+        fall back to a median cut palette of all frames together.
+
+        Returns:
+            list: RGB color tuples, at most COLORS_MAX
+        """
+        colors = set()
+        for frame in frames:
+            found = frame.convert("RGB").getcolors(self.COLORS_MAX)
+            if found is None:
+                colors = None
+                break
+            colors.update(color for _, color in found)
+
+        if colors is not None:
+            return sorted(colors)
+
+        w, h = frames[0].size
+        strip = Image.new("RGB", (w, h*len(frames)))
+        for i, frame in enumerate(frames):
+            strip.paste(frame.convert("RGB"), (0, i*h))
+        palimg = strip.quantize(self.COLORS_MAX, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+        palette = palimg.getpalette()[:3*self.COLORS_MAX]
+        return [tuple(palette[i:i+3]) for i in range(0, len(palette), 3)]
+
+
+    def PaletteImage(self, colors:list)->Image:
+        """
+        "P" image carrying a palette for Image.quantize()
+
+        Unused entries repeat the first color, so no pixel maps to the transparent index.
+        """
+        palimg = Image.new("P", (1, 1))
+        palimg.putpalette([c for color in colors for c in color] + list(colors[0])*(256-len(colors)))
+        return palimg
+
+
+    def Indices(self, frame:Image, palimg:Image, lookup:dict)->Image:
+        """
+        Palette indices of a frame
+
+        Image.quantize() matches colors through a coarse cache and can pick a near
+        neighbour (e.g. 250,250,250 for white), so colors that are in the palette
+        are checked on a one row probe and corrected with a mask if needed.
+
+        Parameters:
+            frame: Image - RGB frame
+            palimg: Image - palette image made by PaletteImage()
+            lookup: dict - RGB color -> palette index
+
+        Returns:
+            Image: indices as "L", so ImageChops compares indices
+        """
+        indexed = frame.quantize(palette=palimg, dither=Image.Dither.NONE)
+        indices = Image.frombytes("L", indexed.size, indexed.tobytes())
+
+        found = frame.getcolors(self.COLORS_MAX)
+        present = [color for _, color in found] if found is not None else list(lookup)
+        probe = Image.new("RGB", (len(present), 1))
+        probe.putdata(present)
+        mapped = probe.quantize(palette=palimg, dither=Image.Dither.NONE).tobytes()
+
+        bands = None
+        for color, index in zip(present, mapped):
+            want = lookup.get(color)
+            if (want is None) or (want == index):
+                continue
+            if bands is None:
+                bands = frame.split()
+            r, g, b = (band.point(lambda v, c=c: 255 if v == c else 0) for band, c in zip(bands, color))
+            indices.paste(want, (0, 0), ImageChops.multiply(ImageChops.multiply(r, g), b))
+        return indices
+
+
+    def Lookup(self, colors:list)->dict:
+        """RGB color -> first palette index of the color"""
+        lookup = {}
+        for index, color in enumerate(colors):
+            lookup.setdefault(color, index)
+        return lookup
+
+
+    def Write(self, frames, fp, colors:list=None)->int:
+        """
+        Encode frames into a file object, e.g. an open file or a socket stream
+
+        Parameters:
+            frames: iterable - RGB or palette images of the same size
+            fp: file object opened for binary writing
+            colors: list - palette of all frames, None to make it from the frames
+
+        Returns:
+            int: encoded size in bytes
+        """
+        raise NotImplementedError
+
+
+    def Encode(self, frames, colors:list=None)->bytes:
+        """Encode frames into memory, see Write()"""
+        f = BytesIO()
+        self.Write(frames, f, colors)
+        return f.getvalue()
+
+
+    def Save(self, frames, filepath:str, colors:list=None)->int:
+        """Encode frames into a file, see Write(), returns the encoded size in bytes"""
+        with open(filepath, "wb") as f:
+            return self.Write(frames, f, colors)
+
+
+
+class CountingWriter():
+    """File object wrapper counting the bytes written through it"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return self.fp.write(data)
+
+    def flush(self):
+        if hasattr(self.fp, "flush"):
+            self.fp.flush()
+
+
+
+class WebPEncoder(AnimationEncoder):
+    """
+    Lossless animated WebP writer
+
+    Pillow needs all frames at once for WebP, so Write() holds them in memory.
+    libwebp finds the few landscape colors itself and stores a palette.
+    """
+
+    FORMAT = "webp"
+    EXT = ".webp"
+    MIME = "image/webp"
+
+    METHOD = 4  # libwebp effort 0 (fast) .. 6 (smallest)
+
+
+    @classmethod
+    def Available(cls)->bool:
+        return features.check("webp_anim")
+
+
+    def Write(self, frames, fp, colors:list=None)->int:
+        frames = [frame.convert("RGB") for frame in frames]
+        out = CountingWriter(fp)
+        frames[0].save(out, format="WEBP", save_all=True, append_images=frames[1:],
+                       duration=self.Durations(frames), loop=self.loop,
+                       lossless=True, quality=100, method=self.METHOD)
+        self.encoded_size = out.size
+        self.encoded_frames = len(frames)
+        return out.size
+
+
+
+class ApngEncoder(AnimationEncoder):
+    """
+    Animated PNG writer
+
+    Frames are mapped to the shared palette and stored as 8 bit indexed PNG
+    frames. Pillow crops every frame to the box that changed and merges
+    identical frames. Write() holds all frames in memory.
+    """
+
+    FORMAT = "apng"
+    EXT = ".png"
+    MIME = "image/apng"
+
+
+    def Write(self, frames, fp, colors:list=None)->int:
+        frames = [frame.convert("RGB") for frame in frames]
+        if colors is None:
+            colors = self.SharedPalette(frames)
+        colors = list(colors)[:self.COLORS_MAX]
+        palimg = self.PaletteImage(colors)
+        lookup = self.Lookup(colors)
+        flat = [c for color in colors for c in color]
+
+        indexed = []
+        for frame in frames:
+            img = Image.frombytes("P", frame.size, self.Indices(frame, palimg, lookup).tobytes())
+            img.putpalette(flat)
+            indexed.append(img)
+
+        out = CountingWriter(fp)
+        indexed[0].save(out, format="PNG", save_all=True, append_images=indexed[1:],
+                        duration=self.Durations(frames), loop=self.loop, optimize=True)
+        self.encoded_size = out.size
+        self.encoded_frames = len(indexed)
+        return out.size
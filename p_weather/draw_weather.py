@@ -1,6 +1,7 @@
 from p_weather.sprites import Sprites
 from p_weather.openweathermap import OpenWeatherMap,WeatherInfo
-from p_weather.sunrise import sun
+from p_weather.solar_almanac import SolarAlmanac
+from p_weather.layout_plan import LayoutPlan,PlacedSprite,PlacedLabel,Precipitation,Smoke
 
 import datetime 
 from PIL import Image
@@ -45,6 +46,12 @@ class DrawWeather():
         (self.IMGEWIDTH,self.IMGHEIGHT) = self.img.size
 
 
+    def SetCanvas(self,canvas):
+        """Draw on another image of the same size with the same sprites"""
+        self.img = canvas
+        self.sprite.SetCanvas(canvas)
+
+
     def TimeDiffToPixels(self,dt):
        ds = dt.total_seconds() 
        secondsperpixel = (WeatherInfo.FORECAST_PERIOD_HOURS*60*60) / DrawWeather.XSTEP
@@ -58,33 +65,93 @@ class DrawWeather():
 
 
 
-    def BlockRange(self,tline,x0,x1):
-        for x in range(x0,x1):
-            tline[x] = Sprites.DISABLED
+    def BlockRange(self,blocked,x0,x1):
+        x0 = min(max(x0,0),len(blocked))
+        x1 = min(max(x1,x0),len(blocked))
+        blocked[x0:x1] = b"\x01"*(x1-x0)
+
+
+    def GroundY(self,tline,blocked,x):
+        """Terrain line at x, or Sprites.DISABLED where the ground is taken"""
+        if blocked[x]:
+            return Sprites.DISABLED
+        return tline[x]
+
+
+    _terrain_steps = {}
+
+    @staticmethod
+    def TerrainSteps(n):
+        """(1-t, t) bezier parameters of the pixels of a slope n pixels wide"""
+        steps = DrawWeather._terrain_steps.get(n)
+        if steps is None:
+            steps = tuple((1-t, t) for t in (float(i)/float(n) for i in range(n)))
+            DrawWeather._terrain_steps[n] = steps
+        return steps
+
+
+    def TerrainLine(self,ystart,nodes):
+        """
+        Build the terrain line from the temperature heights of the forecast columns
+        
+        The line is flat under the house, then every forecast column adds a bezier
+        slope to its height followed by a XFLAT plateau. Each slope is evaluated in one
+        list comprehension over shared bezier parameters instead of per-pixel calls;
+        the expression is mybeizelfnc(t,a,a,b,b) term for term, so heights are identical.
+        """
+        tline = [ystart]*self.XSTART
+        n = int((self.XSTEP-self.XFLAT)/2)
+        a = ystart
+        for b in nodes:
+            tline += [int( u*( u*(u*a+t*a ) + t*( u*a + t*b)) + t*( u*( u*a + t*b)+t*(u*b +t*b)) )
+                      for u, t in self.TerrainSteps(n)]
+            tline += [b]*self.XFLAT
+            n = (self.XSTEP-self.XFLAT)
+            a = b
+
+        length = self.picwidth+self.XSTEP*2
+        tline += [0]*(length-len(tline))
+        del tline[length:]
+        return tline
             
 
 
-    def DrawTemperature(self,f:WeatherInfo,x:int,y:int):
+    def TemperatureLabel(self,f:WeatherInfo,x:int,y:int)->PlacedLabel:
         if (f.IsCelsius):
-            self.sprite.DrawInt(f.PrintableTemperature,x,y+10,True,2)
+            return PlacedLabel(f.PrintableTemperature,x,y+10,True,2)
         else:
-            self.sprite.DrawInt(f.PrintableTemperature,x,y+10,False,1)
+            return PlacedLabel(f.PrintableTemperature,x,y+10,False,1)
+
+
+    def DrawTemperature(self,f:WeatherInfo,x:int,y:int):
+        label = self.TemperatureLabel(f,x,y)
+        self.sprite.DrawInt(label.value,label.x,label.y,label.issign,label.mindigits)
+
+
+    def PlacePrecipitation(self,f:WeatherInfo,x:int,y:int,width:int)->list:
+        items = []
+        if (f.rain>0):
+            items.append(Precipitation(Precipitation.RAIN,f.rain,x,y,width))
+        if (f.snow>0):
+            items.append(Precipitation(Precipitation.SNOW,f.snow,x,y,width))
+        return items
 
 
 
 
     #todo: add thunderstorm
     #todo: add fog
-    def Draw(self, ypos:int, owm:OpenWeatherMap, animate=False, frame_num=0, show_moon_phase=False):
+    def Layout(self, ypos:int, owm:OpenWeatherMap, show_moon_phase=False)->LayoutPlan:
         """
-        Draw the weather landscape
+        Compute where everything of the weather landscape goes, without drawing
         
         Parameters:
             ypos: int - vertical position to start drawing
             owm: OpenWeatherMap - weather data
-            animate: bool - whether to apply animation effects
-            frame_num: int - current frame number for animation
             show_moon_phase: bool - whether moon phase is enabled
+            
+        Returns:
+            LayoutPlan: immutable plan to draw with Render()
         """
         
         self.picheight = self.IMGHEIGHT
@@ -103,17 +170,38 @@ class DrawWeather():
         
         #print("tmin = %f , tmax = %f, range=%f" % (self.tmin,self.tmax,self.temprange))
 
+        items = []
         xpos=0
-        tline = [0]*(self.picwidth+self.XSTEP*2)
         f = owm.GetCurr()
         oldtemp = f.temp
         oldy = self.DegToPix(oldtemp)
-        for i in range(self.XSTART):
-            tline[i] = oldy
         yclouds = int(ypos-self.YSTEP/2)
         f.Print()
 
-        self.sprite.Draw("house",0,xpos,oldy) 
+        t = datetime.datetime.now()#+datetime.timedelta(hours = 1, minutes=0)
+        
+        
+        dt = datetime.timedelta(hours=WeatherInfo.FORECAST_PERIOD_HOURS)
+
+        # forecast of every column, looked up once for all passes below
+        columns = []
+        tf = t 
+        for i in range(int(nforecasrt)+1):
+            fc = owm.Get(tf)
+            if (fc==None):
+                break
+            columns.append((tf,fc))
+            tf += dt
+
+        # terrain line through the temperatures of the forecast columns
+        tline = self.TerrainLine(oldy,[self.DegToPix(fc.temp) for _,fc in columns])
+
+        # ground taken by the house and flowers, trees are not planted there
+        x0 = int(self.XSTART)
+        blocked = bytearray(len(tline))
+        self.BlockRange(blocked,0,x0)
+
+        items.append(PlacedSprite("house",0,xpos,oldy))
         
        
         # convert pressure to smoke angle 
@@ -124,66 +212,19 @@ class DrawWeather():
         if (smokeangle_deg>90):
             smokeangle_deg=90
             
-        # Draw smoke with animation if requested
-        self.sprite.DrawSmoke(xpos+21, self.picheight-oldy+23, smokeangle_deg, animate)
-        
-        self.DrawTemperature(f,xpos+8,oldy)
-        self.sprite.DrawCloud(f.clouds, xpos, yclouds, self.XSTART, self.YSTEP/2, animate)
+        items.append(Smoke(xpos+21, self.picheight-oldy+23, smokeangle_deg))
         
-        # Draw rain/snow with animation if requested
-        self.sprite.DrawRain(f.rain, xpos, yclouds, self.XSTART, tline, animate)
-        self.sprite.DrawSnow(f.snow, xpos, yclouds, self.XSTART, tline)
+        items.append(self.TemperatureLabel(f,xpos+8,oldy))
+        items += self.sprite.PlaceCloud(f.clouds, xpos, yclouds, self.XSTART)
+        items += self.PlacePrecipitation(f, xpos, yclouds, self.XSTART)
 
-
-        t = datetime.datetime.now()#+datetime.timedelta(hours = 1, minutes=0)
         
-        
-        dt = datetime.timedelta(hours=WeatherInfo.FORECAST_PERIOD_HOURS)
-        tf = t 
-        
-        x0 = int(self.XSTART)
-        xpos = x0
-        n = int((self.XSTEP-self.XFLAT)/2)
-        for i in range(int(nforecasrt)+1):
-            f = owm.Get(tf)
-            if (f==None):
-                continue
-                
-            #f.Print()
-            
-            newtemp = f.temp
-            newy = self.DegToPix(newtemp)
-            
-            for i in range(n):
-                tline[xpos+i] = self.mybezier(xpos+i,xpos,oldy,xpos+n,newy)
-
-            for i in range(self.XFLAT):
-                tline[int(xpos+i+n)] = newy
-
-            xpos+=n+self.XFLAT
-
-            n = (self.XSTEP-self.XFLAT)
-            oldtemp = newtemp
-            oldy = newy
-            tf += dt
-
-        
-        tline0 = tline.copy()
-        
-        self.BlockRange(tline,0,x0)
-        
-        
-        s=sun(owm.LAT,owm.LON) 
-        tf = t 
+        almanac=SolarAlmanac.Get(owm.LAT,owm.LON) 
         xpos = self.XSTART
         objcounter=0
-        for i in range(int(nforecasrt)+1):
-            f = owm.Get(tf)
-            if (f==None):
-                continue
+        for tf,f in columns:
 
-            t_sunrise = s.sunrise(tf)
-            t_sunset = s.sunset(tf) 
+            t_sunrise, t_sunset, _ = almanac.Day(tf)
             t_noon = datetime.datetime(tf.year,tf.month,tf.day,12,0,0,0)
             t_midn = datetime.datetime(tf.year,tf.month,tf.day,0,0,0,0)+datetime.timedelta(days=1)
             
@@ -193,7 +234,7 @@ class DrawWeather():
 
             if (tf<=t_sunrise) and (tf+dt>t_sunrise):
                 dx = self.TimeDiffToPixels(t_sunrise-tf)  - self.XSTEP/2
-                self.sprite.Draw("sun",0,xpos+dx,ymoon)
+                items.append(PlacedSprite("sun",0,xpos+dx,ymoon))
                 objcounter+=1
                 if (objcounter==2):
                     break;
@@ -202,7 +243,7 @@ class DrawWeather():
                 dx = self.TimeDiffToPixels(t_sunset-tf)  - self.XSTEP/2
                 # Only draw the static moon if moon phase is not enabled
                 if not show_moon_phase:
-                    self.sprite.Draw("moon",0,xpos+dx,ymoon)
+                    items.append(PlacedSprite("moon",0,xpos+dx,ymoon))
                 objcounter+=1
                 if (objcounter==2):
                     break;
@@ -210,33 +251,28 @@ class DrawWeather():
             if (tf<=t_noon) and (tf+dt>t_noon):
                 dx = self.TimeDiffToPixels(t_noon-tf)  - self.XSTEP/2
                 ix =int(xpos+dx)
-                self.sprite.Draw("flower",1,ix,tline[ix]+1)
-                self.BlockRange(tline,ix-self.FLOWER_LEFT_PX,ix+self.FLOWER_RIGHT_PX)
+                items.append(PlacedSprite("flower",1,ix,self.GroundY(tline,blocked,ix)+1))
+                self.BlockRange(blocked,ix-self.FLOWER_LEFT_PX,ix+self.FLOWER_RIGHT_PX)
 
 
             if (tf<=t_midn) and (tf+dt>t_midn):
                 dx = self.TimeDiffToPixels(t_midn-tf)  - self.XSTEP/2
                 ix =int(xpos+dx)
-                self.sprite.Draw("flower",0,ix,tline[ix]+1)      
-                self.BlockRange(tline,ix-self.FLOWER_LEFT_PX,ix+self.FLOWER_RIGHT_PX)
+                items.append(PlacedSprite("flower",0,ix,self.GroundY(tline,blocked,ix)+1))
+                self.BlockRange(blocked,ix-self.FLOWER_LEFT_PX,ix+self.FLOWER_RIGHT_PX)
                     
 
             xpos+=self.XSTEP
-            tf += dt
         
 
  
         istminprinted = False
         istmaxprinted = False
-        tf = t 
         xpos = self.XSTART
         n = int((self.XSTEP-self.XFLAT)/2)
         f_used = []
         
-        for i in range(int(nforecasrt)+1):
-            f = owm.Get(tf)
-            if (f==None):
-                continue
+        for tf,f in columns:
  
             f.Print()
             dx = self.TimeDiffToPixels(f.t-tf)  - self.XSTEP/2
@@ -245,34 +281,95 @@ class DrawWeather():
             yclouds = int( ypos-self.YSTEP/2 )
             
             if (f.temp==self.tmin) and (not istminprinted):
-                self.DrawTemperature(f,xpos+n,tline0[xpos+n])
+                items.append(self.TemperatureLabel(f,xpos+n,tline[xpos+n]))
                 istminprinted = True
             
             if (f.temp==self.tmax) and (not istmaxprinted):
-                self.DrawTemperature(f,xpos+n,tline0[xpos+n])
+                items.append(self.TemperatureLabel(f,xpos+n,tline[xpos+n]))
                 istmaxprinted = True
 
 
             # todo: apply sprite line width 
             if not (f in f_used):
-                self.sprite.DrawWind(f.windspeed, f.winddeg, ix, tline, animate)
-                self.sprite.DrawCloud(f.clouds, ix, yclouds, self.XSTEP, self.YSTEP/2, animate)
-                
-                # Draw rain/snow with animation if requested
-                self.sprite.DrawRain(f.rain, ix, yclouds, self.XSTEP, tline0, animate)
-                self.sprite.DrawSnow(f.snow, ix, yclouds, self.XSTEP, tline0)
-                
+                items += self.sprite.PlaceWind(f.windspeed, f.winddeg, ix, tline, blocked)
+                items += self.sprite.PlaceCloud(f.clouds, ix, yclouds, self.XSTEP)
+                items += self.PlacePrecipitation(f, ix, yclouds, self.XSTEP)
                 f_used.append(f)
                 
 
             xpos+=self.XSTEP
-            tf += dt
-
 
-        BLACK = 0
 
+        terrain = tline[:self.picwidth]
         for x in range(self.picwidth):
-            if (tline0[x]<self.picheight):
-                self.sprite.Dot(x,tline0[x],Sprites.BLACK)
+            if (terrain[x]>=self.picheight):
+                print("out of range: %i - %i(max %i)" % (x,terrain[x],self.picheight))
+
+        return LayoutPlan(self.picwidth,self.picheight,tuple(tline),tuple(items))
+
+
+
+    def RenderItem(self, plan:LayoutPlan, item, animate=False):
+        """Draw one item of a layout plan"""
+        if isinstance(item,PlacedSprite):
+            self.sprite.Draw(item.name,item.index,item.x,item.y,item.mirror)
+        elif isinstance(item,PlacedLabel):
+            self.sprite.DrawInt(item.value,item.x,item.y,item.issign,item.mindigits)
+        elif isinstance(item,Precipitation):
+            if (item.kind==Precipitation.RAIN):
+                self.sprite.DrawRain(item.value,item.x,item.y,item.width,plan.terrain,animate)
             else:
-                print("out of range: %i - %i(max %i)" % (x,tline0[x],self.picheight))
+                self.sprite.DrawSnow(item.value,item.x,item.y,item.width,plan.terrain)
+        elif isinstance(item,Smoke):
+            self.sprite.DrawSmoke(item.x,item.y,item.angle,animate)
+
+
+    def RenderTerrain(self, plan:LayoutPlan):
+        self.sprite.DrawPoints(range(plan.width),plan.terrain[:plan.width],Sprites.BLACK)
+
+
+    def Render(self, plan:LayoutPlan, animate=False, frame_num=0):
+        """
+        Draw a layout plan onto the canvas
+        
+        Parameters:
+            plan: LayoutPlan - layout made by Layout()
+            animate: bool - whether to apply animation effects
+            frame_num: int - current frame number for animation
+        """
+        if animate:
+            self.RenderStatic(plan)
+            self.RenderAnimated(plan, frame_num)
+            return
+        for item in plan.items:
+            self.RenderItem(plan,item,animate)
+        self.RenderTerrain(plan)
+
+
+    def RenderStatic(self, plan:LayoutPlan):
+        """Draw the part of a plan that is the same in every animation frame"""
+        for item in plan.static_items:
+            self.RenderItem(plan,item,False)
+        self.RenderTerrain(plan)
+
+
+    def RenderAnimated(self, plan:LayoutPlan, frame_num=0):
+        """Draw the moving part of a plan (rain, smoke) over a static layer made by RenderStatic()"""
+        for item in plan.animated_items:
+            self.RenderItem(plan,item,True)
+
+
+    def Draw(self, ypos:int, owm:OpenWeatherMap, animate=False, frame_num=0, show_moon_phase=False):
+        """
+        Draw the weather landscape
+        
+        Parameters:
+            ypos: int - vertical position to start drawing
+            owm: OpenWeatherMap - weather data
+            animate: bool - whether to apply animation effects
+            frame_num: int - current frame number for animation
+            show_moon_phase: bool - whether moon phase is enabled
+        """
+        plan = self.Layout(ypos, owm, show_moon_phase)
+        self.Render(plan, animate, frame_num)
+        return plan
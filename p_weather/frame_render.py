@@ -0,0 +1,133 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from PIL import Image
+
+from p_weather.sprites import Sprites, SpriteAtlas
+from p_weather.draw_weather import DrawWeather
+from p_weather.layout_plan import LayoutPlan
+
+
+class AnimationSession():
+    """
+    State of one animation, shared by all of its frames
+
+    The session owns one Sprites (colors, random generator, cloud, wind and rain
+    particle state) and one DrawWeather. It draws the static layer once and every
+    frame is a copy of it with the moving layers drawn over it.
+
+    A frame depends only on the session arguments and the frame number, so the
+    frames are the same whether they are drawn in order by one session or out of
+    order by the sessions of FramePool workers.
+    """
+
+    def __init__(self, spritesdir:str, plan:LayoutPlan, mode:str, background, seed:int, is_dark_bg:bool, total_frames:int):
+        """
+        Parameters:
+            spritesdir: str - sprite directory
+            plan: LayoutPlan - layout shared by all frames
+            mode: str - canvas mode, "RGB" or "P"
+            background: RGB tuple or palette index filling the canvas
+            seed: int - random seed shared by all frames
+            is_dark_bg: bool - whether the background is dark
+            total_frames: int - number of frames in the animation
+        """
+        self.plan = plan
+        self.total_frames = total_frames
+
+        # House, terrain, flowers, trees, clouds, sun and moon are drawn once
+        self.static_layer = Image.new(mode, (plan.width, plan.height), color=background)
+        self.sprites = Sprites(spritesdir, self.static_layer, seed=seed)
+        self.sprites.total_frames = total_frames
+        self.sprites.adjust_colors_for_background(is_dark_bg)
+        self.art = DrawWeather(self.static_layer, self.sprites)
+        self.art.RenderStatic(plan)
+
+
+    def Frame(self, frame_num:int)->Image:
+        """
+        Draw one frame
+
+        Parameters:
+            frame_num: int - frame to draw
+
+        Returns:
+            Image: new canvas with rain and smoke of the frame
+        """
+        img = self.static_layer.copy()
+        self.art.SetCanvas(img)
+        self.sprites.current_frame = frame_num
+        if self.total_frames > 1:
+            self.art.RenderAnimated(self.plan, frame_num=frame_num)
+        else:
+            # A single frame is a still image, rain and smoke are drawn as in MakeImage()
+            for item in self.plan.animated_items:
+                self.art.RenderItem(self.plan, item, False)
+        return img
+
+
+    def Frames(self):
+        """Generator drawing the frames in frame order"""
+        for frame_num in range(self.total_frames):
+            yield self.Frame(frame_num)
+
+
+# Session of the animation a worker process is drawing, reused by its next frames
+_worker_session = None
+
+
+def _InitWorker(spritesdir:str):
+    # Decode the sprite sheets once per worker, not once per frame
+    SpriteAtlas.Get(spritesdir, Sprites.EXT)
+
+
+def _RenderWorkerFrame(task):
+    global _worker_session
+    args, frame_num = task
+    if (_worker_session is None) or (_worker_session[0] != args):
+        _worker_session = (args, AnimationSession(*args))
+    return _worker_session[1].Frame(frame_num)
+
+
+class FramePool():
+    """
+    Draws animation frames on a process pool
+
+    Workers are started on first use and kept until Close(), so the sprite atlas
+    and the sprite variant caches of every worker are reused by later animations.
+    Every worker builds its own AnimationSession once per animation.
+    """
+
+    def __init__(self, spritesdir:str, workers:int):
+        """
+        Parameters:
+            spritesdir: str - sprite directory, loaded by every worker on start
+            workers: int - number of worker processes
+        """
+        self.spritesdir = spritesdir
+        self.workers = workers
+        self.executor = None
+
+
+    def Render(self, plan:LayoutPlan, mode:str, background, seed:int, is_dark_bg:bool, total_frames:int):
+        """
+        Draw all frames of an animation, see AnimationSession for the parameters
+
+        Returns:
+            iterator: frames in frame order, each available as soon as it and the
+                      frames before it are done
+        """
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                initializer=_InitWorker,
+                                                initargs=(self.spritesdir,))
+        args = (self.spritesdir, plan, mode, background, seed, is_dark_bg, total_frames)
+        chunksize = max(1, total_frames // self.workers)
+        return self.executor.map(_RenderWorkerFrame, zip(repeat(args), range(total_frames)), chunksize=chunksize)
+
+
+    def Close(self):
+        """Stop the worker processes"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,149 @@
+import struct
+
+from PIL import Image, ImageChops, GifImagePlugin
+
+from p_weather.animation_encoder import AnimationEncoder
+
+
+class GifEncoder(AnimationEncoder):
+    """
+    Animated GIF writer for weather landscape frames
+
+    All frames are mapped to one global palette, so no frame carries its own color
+    table. Every frame after the first only stores the box of pixels that changed,
+    with unchanged pixels inside the box set to a transparent index. Frames equal
+    to the previous one are merged into it by extending its duration.
+    """
+
+    FORMAT = "gif"
+    EXT = ".gif"
+    MIME = "image/gif"
+
+    DISPOSAL_KEEP = 1   # leave the frame in place, the next delta is drawn over it
+
+
+    def Header(self, size:tuple, palette:bytes, colors:int)->bytes:
+        """GIF89a header with the global color table and the loop extension"""
+        bits = max(1, (colors-1).bit_length())
+        table = palette[:3*colors].ljust(3*(1 << bits), b"\0")
+        header = b"GIF89a" + struct.pack("<HHBBB", size[0], size[1], 0x80 | (bits-1), 0, 0) + table
+        header += b"!\xff\x0bNETSCAPE2.0" + struct.pack("<BBHB", 3, 1, self.loop, 0)
+        return header
+
+
+    def Delta(self, previous:Image, current:Image, transparent:int):
+        """
+        Changed pixels of a frame
+
+        Parameters:
+            previous: Image - previous frame as palette indices ("L")
+            current: Image - this frame as palette indices ("L")
+            transparent: int - palette index of unchanged pixels
+
+        Returns:
+            tuple: ("P" image of the changed box, box offset), None if nothing changed
+        """
+        diff = ImageChops.difference(previous, current)
+        bbox = diff.getbbox()
+        if bbox is None:
+            return None
+        mask = diff.crop(bbox).point(lambda v: 255 if v else 0)
+        delta = Image.new("L", mask.size, transparent)
+        delta.paste(current.crop(bbox), (0, 0), mask)
+        return Image.frombytes("P", delta.size, delta.tobytes()), bbox[:2]
+
+
+    def Stream(self, frames, colors:list):
+        """
+        Encode frames as an animated GIF one frame at a time
+
+        Only the previous frame is kept, so frames can come from a generator and
+        the output can go to a file or a socket while later frames are drawn.
+
+        Parameters:
+            frames: iterable - RGB or palette images of the same size, info["duration"]
+                               overrides the encoder duration of a frame
+            colors: list - RGB palette of all frames, see SharedPalette(), colors
+                           missing from it are mapped to the nearest one
+
+        Returns:
+            generator: bytes chunks of the GIF file, the total size is kept in encoded_size
+        """
+        colors = list(colors)[:self.COLORS_MAX]
+        palimg = self.PaletteImage(colors)
+        lookup = self.Lookup(colors)
+        transparent = len(colors)
+        self.encoded_size = 0
+        self.encoded_frames = 0
+
+        def chunks(img, offset, duration, transparency):
+            params = dict(duration=duration, disposal=self.DISPOSAL_KEEP)
+            if transparency is not None:
+                params["transparency"] = transparency
+            return GifImagePlugin.getdata(img, offset, **params)
+
+        # A stored frame is written once the next one is known not to extend its duration
+        pending = None
+        previous = None
+        for frame in frames:
+            duration = frame.info.get("duration", self.duration)
+            current = self.Indices(frame.convert("RGB"), palimg, lookup)
+
+            if previous is None:
+                header = self.Header(frame.size, bytes(palimg.getpalette()), transparent + 1)
+                self.encoded_size += len(header)
+                yield header
+                pending = [Image.frombytes("P", current.size, current.tobytes()), (0, 0), duration, None]
+            else:
+                delta = self.Delta(previous, current, transparent)
+                if delta is None:
+                    pending[2] += duration
+                else:
+                    for chunk in chunks(*pending):
+                        self.encoded_size += len(chunk)
+                        yield chunk
+                    self.encoded_frames += 1
+                    pending = [delta[0], delta[1], duration, transparent]
+            previous = current
+
+        if pending is not None:
+            for chunk in chunks(*pending):
+                self.encoded_size += len(chunk)
+                yield chunk
+            self.encoded_frames += 1
+        self.encoded_size += 1
+        yield b";"
+
+
+    def Encode(self, frames, colors:list=None)->bytes:
+        """
+        Encode frames as an animated GIF, with the palette of all frames if colors is None
+
+        Returns:
+            bytes: GIF file data, its size is kept in encoded_size
+        """
+        if colors is None:
+            frames = list(frames)
+            colors = self.SharedPalette(frames)
+        return b"".join(self.Stream(frames, colors))
+
+
+    def Write(self, frames, fp, colors:list=None)->int:
+        """
+        Encode frames into a file object, e.g. an open file or a socket stream
+
+        Parameters:
+            frames: iterable - frames as for Stream()
+            fp: file object opened for binary writing
+            colors: list - palette of all frames, None to make it from the frames,
+                           which then are all held in memory
+
+        Returns:
+            int: encoded size in bytes
+        """
+        if colors is None:
+            frames = list(frames)
+            colors = self.SharedPalette(frames)
+        for chunk in self.Stream(frames, colors):
+            fp.write(chunk)
+        return self.encoded_size
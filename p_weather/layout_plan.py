@@ -0,0 +1,93 @@
+from typing import NamedTuple, Tuple, Union
+
+
+class PlacedSprite(NamedTuple):
+    """Sprite at its final canvas position, drawn with Sprites.Draw()"""
+    name: str
+    index: int
+    x: float
+    y: float
+    mirror: bool = False
+
+
+class PlacedLabel(NamedTuple):
+    """Integer label at its final canvas position, drawn with Sprites.DrawInt()"""
+    value: float
+    x: int
+    y: int
+    issign: bool
+    mindigits: int
+
+
+class Precipitation(NamedTuple):
+    """Rain or snow falling from y down to the terrain line over a range of columns"""
+
+    RAIN = "rain"
+    SNOW = "snow"
+
+    kind: str
+    value: float
+    x: int
+    y: int
+    width: int
+
+
+class Smoke(NamedTuple):
+    """Chimney smoke, drawn with Sprites.DrawSmoke()"""
+    x: int
+    y: int
+    angle: float
+
+
+PlanItem = Union[PlacedSprite, PlacedLabel, Precipitation, Smoke]
+
+
+def IsAnimated(item) -> bool:
+    """Whether an item moves between animation frames: rain and smoke do, the rest is static"""
+    if isinstance(item, Smoke):
+        return True
+    return isinstance(item, Precipitation) and (item.kind == Precipitation.RAIN)
+
+
+class LayoutPlan(NamedTuple):
+    """
+    Immutable layout of one weather landscape
+
+    Made by DrawWeather.Layout() and drawn by DrawWeather.Render(). Everything
+    that depends on the forecast, the clock and the random layout is decided
+    here, so one plan can be drawn for any number of frames or backgrounds.
+
+    Attributes:
+        width: int - canvas width the plan was made for
+        height: int - canvas height the plan was made for
+        terrain: tuple - terrain line height for every x (with padding on the right)
+        items: tuple - sprites, labels, precipitation and smoke in drawing order
+    """
+    width: int
+    height: int
+    terrain: Tuple[int, ...]
+    items: Tuple[PlanItem, ...]
+
+    @property
+    def sprites(self) -> Tuple[PlacedSprite, ...]:
+        return tuple(item for item in self.items if isinstance(item, PlacedSprite))
+
+    @property
+    def labels(self) -> Tuple[PlacedLabel, ...]:
+        return tuple(item for item in self.items if isinstance(item, PlacedLabel))
+
+    @property
+    def precipitation(self) -> Tuple[Precipitation, ...]:
+        return tuple(item for item in self.items if isinstance(item, Precipitation))
+
+    @property
+    def smoke(self) -> Tuple[Smoke, ...]:
+        return tuple(item for item in self.items if isinstance(item, Smoke))
+
+    @property
+    def static_items(self) -> Tuple[PlanItem, ...]:
+        return tuple(item for item in self.items if not IsAnimated(item))
+
+    @property
+    def animated_items(self) -> Tuple[PlanItem, ...]:
+        return tuple(item for item in self.items if IsAnimated(item))
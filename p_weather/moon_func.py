@@ -2,33 +2,339 @@
 
 # Used example from https://github.com/nikospag/Python-Moon-phase
 
-import ephem
+import os
 import math
-from PIL import Image
+import datetime
+import threading
+from PIL import Image, ImageDraw
 
-def process_moon_phase(moonpath="moon.png", phasepath="phase.png", textpath="moon.txt"):
+
+def phase_spans(height, phase):
     """
-    Processes a full-moon image to simulate the moon phase effect,
-    writes the processed image and moon parameters to files,
-    and returns the computed values.
+    Dark span of every moon row for a phase
 
     Parameters:
-        moonpath (str): Path to the input full-moon image.
-        phasepath (str): Path where the output phase image will be saved.
-        textpath (str): Path where the output text file will be saved.
+        height (int): Height of the full-moon image, its radius is height // 2.
+        phase (float): Dark part, negative darkens from the left, positive from the right,
+                       0 for full moon and -1 or 1 for new moon.
+
+    Returns:
+        list: (y, x0, x1) tuples, pixels x0 <= x < x1 of row y are dark.
+    """
+    radius = height // 2
+    spans = []
+    if phase == 0:
+        return spans
+    for y in range(radius):
+        # Calculate x-offset using the circle equation.
+        x_offset = round(math.sqrt(radius**2 - y**2))
+        if phase < 0:
+            X = radius - x_offset
+            clear_width = round(2 * (radius - X) * abs(phase))
+            x0, x1 = X, X + clear_width
+        else:
+            X = radius + x_offset
+            clear_width = round(2 * (radius - X) * phase)
+            x0, x1 = X + clear_width, X  # clear_width is negative
+        if x1 <= x0:
+            continue
+        Y_top = radius - y
+        Y_bottom = radius + y
+        spans.append((Y_top, x0, x1))
+        if Y_top != Y_bottom and Y_bottom < height:
+            spans.append((Y_bottom, x0, x1))
+    return spans
+
+
+def phase_mask(size, phase):
+    """
+    Mask of the dark region of the moon for a phase, see phase_spans()
+
+    Returns:
+        Image: "L" mask, 255 where the moon is dark.
+    """
+    mask = Image.new("L", size, 0)
+    draw = ImageDraw.Draw(mask)
+    for y, x0, x1 in phase_spans(size[1], phase):
+        draw.line([(x0, y), (x1 - 1, y)], fill=255)
+    return mask
+
+
+def apply_phase(img, phase):
+    """
+    Make the dark region of a full-moon image transparent
+
+    Parameters:
+        img (Image): RGBA full-moon image, modified in place.
+        phase (float): Dark part, see phase_spans().
+
+    Returns:
+        Image: img
+    """
+    alpha = img.getchannel("A")
+    alpha.paste(0, (0, 0), phase_mask(img.size, phase))
+    img.putalpha(alpha)
+    return img
+
+
+class MoonPhaseAtlas():
+    """
+    Moon phase images at display size, made once per phase step
+
+    Phases are quantized to STEPS steps per unit, so every 1% of illumination has
+    its own image and looking a phase up is a dict hit once it was made.
+    """
+
+    STEPS = 100
+
+    _atlases = {}
+    _lock = threading.Lock()
+
+    def __init__(self, moonpath, width):
+        """
+        Parameters:
+            moonpath (str): Path to the full-moon image.
+            width (int): Width of the phase images, the height keeps the aspect ratio.
+        """
+        self.moon = Image.open(moonpath).convert("RGBA")
+        self.width = width
+        self.phases = {}
+        self.phases_lock = threading.Lock()
+
+    @classmethod
+    def Get(cls, moonpath, width):
+        """Return the process-wide atlas of a full-moon image and display width"""
+        key = (os.path.abspath(moonpath), width)
+        with cls._lock:
+            atlas = cls._atlases.get(key)
+            if atlas is None:
+                atlas = cls(moonpath, width)
+                cls._atlases[key] = atlas
+        return atlas
+
+    def Key(self, phase):
+        """Phase step of a phase, -STEPS..STEPS"""
+        return max(-self.STEPS, min(self.STEPS, round(phase * self.STEPS)))
+
+    def Make(self, key):
+        """Phase image of a phase step, resized to the atlas width"""
+        img = apply_phase(self.moon.copy(), key / self.STEPS)
+        width, height = img.size
+        ratio = width / height
+        return img.resize((self.width, int(self.width / ratio)), Image.LANCZOS)
+
+    def Phase(self, phase):
+        """
+        Phase image at display size
+
+        Parameters:
+            phase (float): Dark part, see phase_spans().
+
+        Returns:
+            Image: RGBA phase image, shared, do not modify.
+        """
+        key = self.Key(phase)
+        img = self.phases.get(key)
+        if img is None:
+            img = self.Make(key)
+            with self.phases_lock:
+                img = self.phases.setdefault(key, img)
+        return img
+
+    def Build(self):
+        """Make the images of all phase steps in advance"""
+        for key in range(-self.STEPS, self.STEPS + 1):
+            self.Phase(key / self.STEPS)
+        return self
+
+
+# Periodic terms of the moon longitude (1e-6 degree) and distance (1e-3 km) from
+# Meeus, Astronomical Algorithms, table 47.A, the terms above 3 arcsec:
+# (D, M, M', F multipliers, longitude, distance)
+MOON_TERMS = (
+    (0, 0, 1, 0, 6288774, -20905355),
+    (2, 0, -1, 0, 1274027, -3699111),
+    (2, 0, 0, 0, 658314, -2955968),
+    (0, 0, 2, 0, 213618, -569925),
+    (0, 1, 0, 0, -185116, 48888),
+    (0, 0, 0, 2, -114332, -3149),
+    (2, 0, -2, 0, 58793, 246158),
+    (2, -1, -1, 0, 57066, -152138),
+    (2, 0, 1, 0, 53322, -170733),
+    (2, -1, 0, 0, 45758, -204586),
+    (0, 1, -1, 0, -40923, -129620),
+    (1, 0, 0, 0, -34720, 108743),
+    (0, 1, 1, 0, -30383, 104755),
+    (2, 0, 0, -2, 15327, 10321),
+    (0, 0, 1, 2, -12528, 0),
+    (0, 0, 1, -2, 10980, 79661),
+    (4, 0, -1, 0, 10675, -34782),
+    (0, 0, 3, 0, 10034, -23210),
+    (4, 0, -2, 0, 8548, -21636),
+    (2, 1, -1, 0, -7888, 24208),
+    (2, 1, 0, 0, -6766, 30824),
+    (1, 0, -1, 0, -5163, -8379),
+    (1, 1, 0, 0, 4987, -16675),
+    (2, -1, 1, 0, 4036, -12831),
+)
+
+# Full moon corrections (days), Meeus chapter 49: (E power, M, M', F, Omega multipliers, coefficient)
+FULL_MOON_TERMS = (
+    (0, 0, 1, 0, 0, -0.40614),
+    (1, 1, 0, 0, 0, 0.17302),
+    (0, 0, 2, 0, 0, 0.01614),
+    (0, 0, 0, 2, 0, 0.01043),
+    (1, -1, 1, 0, 0, 0.00734),
+    (1, 1, 1, 0, 0, -0.00515),
+    (2, 2, 0, 0, 0, 0.00209),
+    (0, 0, 1, -2, 0, -0.00111),
+    (0, 0, 1, 2, 0, -0.00057),
+    (1, 1, 2, 0, 0, 0.00056),
+    (0, 0, 3, 0, 0, -0.00042),
+    (1, 1, 0, 2, 0, 0.00042),
+    (1, 1, 0, -2, 0, 0.00038),
+    (1, -1, 2, 0, 0, -0.00024),
+    (0, 0, 0, 0, 1, -0.00017),
+)
+
+SYNODIC_MONTH = 29.530588861    # days
+JD_UNIX_EPOCH = 2440587.5       # Julian day of 1970-01-01 00:00 UTC
+JD_J2000 = 2451545.0
+DELTA_T = 69.0 / 86400          # TT - UTC in days, close enough for a display
+
+
+def julian_day(when=None):
+    """Julian day of a datetime (naive datetimes are local time), None for now"""
+    if when is None:
+        when = datetime.datetime.now()
+    return when.timestamp() / 86400 + JD_UNIX_EPOCH
+
+
+def moon_position(jd):
+    """
+    Low precision geocentric moon, after Meeus, Astronomical Algorithms, chapters 25, 47 and 48
+
+    Parameters:
+        jd (float): Julian day.
+
+    Returns:
+        tuple: (elongation, illuminated fraction, distance) - elongation of the moon from
+               the sun in ecliptic longitude, degrees 0..360 (new moon=0, full moon=180),
+               illuminated fraction 0..1, distance of the centers in Km.
+    """
+    T = (jd + DELTA_T - JD_J2000) / 36525
+    rad = math.radians
+
+    # Mean elements of the moon and the sun, degrees
+    Lm = 218.3164477 + 481267.88123421 * T
+    D = 297.8501921 + 445267.1114034 * T
+    M = 357.5291092 + 35999.0502909 * T
+    Mm = 134.9633964 + 477198.8675055 * T
+    F = 93.2720950 + 483202.0175233 * T
+    E = 1 - 0.002516 * T - 0.0000074 * T * T
+
+    sum_l = 0.0
+    sum_r = 0.0
+    for d, m, mm, f, l, r in MOON_TERMS:
+        arg = rad(d * D + m * M + mm * Mm + f * F)
+        e = E ** abs(m)
+        sum_l += e * l * math.sin(arg)
+        sum_r += e * r * math.cos(arg)
+    moon_lon = Lm + sum_l / 1e6
+    distance = 385000.56 + sum_r / 1000
+
+    # Sun true longitude
+    L0 = 280.46646 + 36000.76983 * T
+    C = ((1.914602 - 0.004817 * T) * math.sin(rad(M))
+         + (0.019993 - 0.000101 * T) * math.sin(rad(2 * M))
+         + 0.000289 * math.sin(rad(3 * M)))
+    sun_lon = L0 + C
+
+    # Phase angle and illuminated fraction
+    i = (180 - D - 6.289 * math.sin(rad(Mm)) + 2.100 * math.sin(rad(M))
+         - 1.274 * math.sin(rad(2 * D - Mm)) - 0.658 * math.sin(rad(2 * D))
+         - 0.214 * math.sin(rad(2 * Mm)) - 0.110 * math.sin(rad(D)))
+    illuminated = (1 + math.cos(rad(i))) / 2
+
+    return (moon_lon - sun_lon) % 360, illuminated, distance
+
+
+def next_full_moon(jd):
+    """Julian day (UTC) of the first full moon after jd, after Meeus chapter 49"""
+    rad = math.radians
+    k = math.floor((jd - 2451550.09766) / SYNODIC_MONTH) - 0.5
+    while True:
+        T = k / 1236.85
+        full = (2451550.09766 + SYNODIC_MONTH * k + 0.00015437 * T**2
+                - 0.000000150 * T**3 + 0.00000000073 * T**4)
+        M = 2.5534 + 29.10535670 * k - 0.0000014 * T**2 - 0.00000011 * T**3
+        Mm = 201.5643 + 385.81693528 * k + 0.0107582 * T**2 + 0.00001238 * T**3 - 0.000000058 * T**4
+        F = 160.7108 + 390.67050284 * k - 0.0016118 * T**2 - 0.00000227 * T**3 + 0.000000011 * T**4
+        O = 124.7746 - 1.56375588 * k + 0.0020672 * T**2 + 0.00000215 * T**3
+        E = 1 - 0.002516 * T - 0.0000074 * T * T
+        for e, m, mm, f, o, c in FULL_MOON_TERMS:
+            full += c * E**e * math.sin(rad(m * M + mm * Mm + f * F + o * O))
+        full -= DELTA_T
+        if full > jd:
+            return full
+        k += 1
+
+
+def moon_data(when=None, precise=False):
+    """
+    Computes the moon parameters.
+
+    The built-in low precision ephemeris is good to a fraction of a percent of
+    illumination, far below a pixel of the displayed moon. precise=True uses the
+    ephem package instead, which is only imported then.
+
+    Parameters:
+        when (datetime): Time to compute for, naive datetimes are local time, None for now.
+        precise (bool): Use ephem.
 
     Returns:
         dict: A dictionary containing:
+            - phase: Dark part of the moon, see phase_spans().
             - age: Moon age in percent (new moon=0%, full moon=50%).
             - illumination: Illumination in percent (new moon=0%, full moon=100%).
             - distance: Moon distance in Km.
             - next_full_moon: Next full moon date and local time as a formatted string.
     """
+    if precise:
+        return ephem_moon_data(when)
+
+    jd = julian_day(when)
+    elongation, illuminated, dist = moon_position(jd)
+    age = elongation / 360 * 100    # new moon=0%, full moon=50%
+
+    full = next_full_moon(jd)
+    fullmoon = datetime.datetime.fromtimestamp((full - JD_UNIX_EPOCH) * 86400).strftime('%d %b, %H:%M')
+
+    illum = illuminated * 100       # Illumination: new moon=0%, full moon=100%
+    phase = 1 - illuminated
+    if elongation < 180:            # waxing, the moon is east of the sun
+        phase = -phase
+
+    return {
+        "phase": phase,
+        "age": age,
+        "illumination": illum,
+        "distance": dist,
+        "next_full_moon": fullmoon
+    }
+
+
+def ephem_moon_data(when=None):
+    """Computes the moon parameters with the ephem package, see moon_data()"""
+    import ephem
+
+    date = ephem.now() if when is None else ephem.Date(datetime.datetime.fromtimestamp(when.timestamp(), datetime.timezone.utc).replace(tzinfo=None))
+
     # Compute moon parameters using ephem.
     m = ephem.Moon()
     s = ephem.Sun()
-    m.compute()
-    s.compute()
+    m.compute(date)
+    s.compute(date)
     sun_glon = ephem.degrees(s.hlon + math.pi).norm
     moon_glon = m.hlon
     age = ephem.degrees(moon_glon - sun_glon).norm
@@ -39,7 +345,7 @@ def process_moon_phase(moonpath="moon.png", phasepath="phase.png", textpath="moo
     dist = m_au * au / 1000         # Moon distance in Km
     
     a = m.elong
-    dt = ephem.next_full_moon(ephem.now())
+    dt = ephem.next_full_moon(date)
     dtlocal = ephem.localtime(dt)
     fullmoon = dtlocal.strftime('%d %b, %H:%M')
     
@@ -49,71 +355,52 @@ def process_moon_phase(moonpath="moon.png", phasepath="phase.png", textpath="moo
     if a > 0:
         phase = -phase
 
-    # Open the image using PIL and ensure it has an alpha channel.
-    img = Image.open(moonpath).convert("RGBA")
-    width, height = img.size
-    radius = height // 2
+    return {
+        "phase": phase,
+        "age": age,
+        "illumination": illum,
+        "distance": dist,
+        "next_full_moon": fullmoon
+    }
 
-    # Access the pixel data for modifications.
-    pixels = img.load()
 
-    # Process the image based on the phase.
-    if phase < 0:
-        phase = abs(phase)
-        for y in range(radius):
-            # Calculate x-offset using the circle equation.
-            x_offset = round(math.sqrt(radius**2 - y**2))
-            X = radius - x_offset
-            Y_top = radius - y
-            Y_bottom = radius + y
-            moon_width = 2 * (radius - X)
-            clear_width = round(moon_width * phase)
-            x_clear = X + clear_width
-            # Set alpha=0 for pixels in the dark region.
-            for cx in range(X, x_clear):
-                r, g, b, _ = pixels[cx, Y_top]
-                pixels[cx, Y_top] = (r, g, b, 0)
-                if Y_top != Y_bottom and Y_bottom < height:
-                    r, g, b, _ = pixels[cx, Y_bottom]
-                    pixels[cx, Y_bottom] = (r, g, b, 0)
-    elif phase > 0:
-        phase = abs(phase)
-        for y in range(radius):
-            x_offset = round(math.sqrt(radius**2 - y**2))
-            X = radius + x_offset
-            Y_top = radius - y
-            Y_bottom = radius + y
-            moon_width = 2 * (radius - X)
-            clear_width = round(moon_width * phase)
-            x_clear = X + clear_width  # x_clear is less than X.
-            for cx in range(x_clear, X):
-                r, g, b, _ = pixels[cx, Y_top]
-                pixels[cx, Y_top] = (r, g, b, 0)
-                if Y_top != Y_bottom and Y_bottom < height:
-                    r, g, b, _ = pixels[cx, Y_bottom]
-                    pixels[cx, Y_bottom] = (r, g, b, 0)
+def process_moon_phase(moonpath="moon.png", phasepath=None, textpath=None, precise=False):
+    """
+    Processes a full-moon image to simulate the current moon phase effect
+    and returns the image with the computed values, optionally writing them to files.
+
+    Parameters:
+        moonpath (str): Path to the input full-moon image.
+        phasepath (str): Path where the output phase image will be saved, None to skip.
+        textpath (str): Path where the output text file will be saved, None to skip.
+        precise (bool): Compute the moon with ephem, see moon_data().
+
+    Returns:
+        dict: The values of moon_data() and:
+            - image: RGBA phase image, full size.
+    """
+    data = moon_data(precise=precise)
+
+    # Open the image using PIL, ensure it has an alpha channel and clear the dark region.
+    img = apply_phase(Image.open(moonpath).convert("RGBA"), data["phase"])
 
     # Save the modified image.
-    img.save(phasepath)
+    if phasepath is not None:
+        img.save(phasepath)
 
     # Write the computed data to the text file.
-    with open(textpath, "w") as file:
-        file.write("{:.2f}\n".format(age))
-        file.write("{:.2f}\n".format(illum))
-        file.write("{:.0f}\n".format(dist))
-        file.write("{}\n".format(fullmoon))
+    if textpath is not None:
+        with open(textpath, "w") as file:
+            file.write("{:.2f}\n".format(data["age"]))
+            file.write("{:.2f}\n".format(data["illumination"]))
+            file.write("{:.0f}\n".format(data["distance"]))
+            file.write("{}\n".format(data["next_full_moon"]))
 
     # Return the computed moon parameters.
-    return {
-        "age": age,
-        "illumination": illum,
-        "distance": dist,
-        "next_full_moon": fullmoon
-    }
+    return dict(data, image=img)
 
 if __name__ == "__main__":
     # For testing when running this file directly.
-    results = process_moon_phase()
+    results = process_moon_phase(phasepath="phase.png", textpath="moon.txt")
     print("Moon Phase Results:")
     print(results)
-
@@ -2,6 +2,7 @@ import os
 import time
 import json
 import datetime
+import bisect
 from urllib.request import urlopen
 
 
@@ -170,6 +171,7 @@ class OpenWeatherMap():
         self.URL_FOREAST = self.OWMURL+"forecast?"+reqstr
         self.URL_CURR =  self.OWMURL+"weather?"+reqstr
         self.f = []
+        self.MakeIndex()
         
         if not os.path.exists(self.cfg.rootdir):
             os.makedirs(self.cfg.rootdir)
@@ -218,23 +220,47 @@ class OpenWeatherMap():
 
 
 
+    TEMP_NONE_MAX = -999
+    TEMP_NONE_MIN = 999
+
+    def MakeIndex(self):
+        """
+        Index the parsed entries for O(log n) lookups
+
+        Get() returns the first entry in list order later than a time, GetTempRange()
+        covers the forecast entries in list order up to the first one later than a
+        time. Both need "the lowest list position among the entries later than t",
+        kept as suffix minimums over the entries sorted by time and found with bisect.
+        Running temperature min/max over the list positions answer the range queries.
+        """
+        n = len(self.f)
+        order = sorted(range(n), key=lambda i: self.f[i].t)
+        self.index_times = [self.f[i].t for i in order]
+
+        # lowest list position among the sorted entries k.. (all entries / forecast only)
+        self.index_first = [n]*(n+1)
+        self.index_first_fcst = [n]*(n+1)
+        for k in range(n-1, -1, -1):
+            i = order[k]
+            self.index_first[k] = min(i, self.index_first[k+1])
+            self.index_first_fcst[k] = min(i, self.index_first_fcst[k+1]) if (i!=0) else self.index_first_fcst[k+1]
+
+        # running min/max of the forecast temperatures over the list positions 1..i
+        self.index_tmin = [self.TEMP_NONE_MIN]*max(n,1)
+        self.index_tmax = [self.TEMP_NONE_MAX]*max(n,1)
+        for i in range(1, n):
+            self.index_tmin[i] = min(self.index_tmin[i-1], self.f[i].temp)
+            self.index_tmax[i] = max(self.index_tmax[i-1], self.f[i].temp)
+
+
+
     def GetTempRange(self,maxtime):
         if len(self.f)==0:
             return None
-        tmax = -999
-        tmin = 999
-        isfirst = True
-        for f in self.f:
-            if (isfirst):
-                isfirst = False
-                continue
-            if (f.t>maxtime):
-                break
-            if (f.temp>tmax):
-                tmax = f.temp
-            if (f.temp<tmin):
-                tmin = f.temp
-        return (tmin,tmax)
+        # forecast entries before the first one later than maxtime
+        k = bisect.bisect_right(self.index_times, maxtime)
+        last = self.index_first_fcst[k]-1
+        return (self.index_tmin[last],self.index_tmax[last])
 
 
     def FromJSON(self,data_curr,data_fcst):
@@ -243,12 +269,14 @@ class OpenWeatherMap():
         f = WeatherInfo(cdata,self.cfg)
         self.f.append(f)
         if not ('list' in data_fcst):
+            self.MakeIndex()
             return False
         for fdata in data_fcst['list']:
             if not WeatherInfo.Check(fdata):
                 continue
             f = WeatherInfo(fdata,self.cfg)
             self.f.append(f)
+        self.MakeIndex()
         return True
 
 
@@ -281,9 +309,10 @@ class OpenWeatherMap():
 
 
     def Get(self,time):
-        for f in self.f:
-            if (f.t>time):
-                return f
+        k = bisect.bisect_right(self.index_times, time)
+        i = self.index_first[k]
+        if (i<len(self.f)):
+            return self.f[i]
         return None
 
 
@@ -0,0 +1,145 @@
+import datetime
+import threading
+from array import array
+
+from p_weather.sunrise import sun_batch, decimal_day_seconds, local_tzoffset
+
+
+class SolarAlmanac():
+    """
+    Sunrise, sunset and solar noon of one location, computed once per date
+
+    A day is computed at local noon and kept as seconds from local midnight, so
+    every render, column and background of that day shares one calculation.
+    Precompute() fills a compact table for a range of days ahead, dates outside
+    of it are computed on first use and kept in a dict. PrecomputeMany() fills
+    the tables of many locations with one sun_batch() pass.
+    """
+
+    FIELDS = 3  # sunrise, sunset, solar noon
+
+    _almanacs = {}
+    _lock = threading.Lock()
+
+    def __init__(self, lat, lon, tzoffset):
+        """
+        Parameters:
+            lat (float): Latitude, north is positive.
+            lon (float): Longitude, east is positive.
+            tzoffset (float): Local time zone offset in hours, east is positive.
+        """
+        self.lat = lat
+        self.lon = lon
+        self.tzoffset = tzoffset
+        self.days = {}
+        self.table = None   # (first date ordinal, array of FIELDS seconds per day)
+
+    @classmethod
+    def Get(cls, lat, lon):
+        """Return the process-wide almanac of a location in the current time zone offset"""
+        tzoffset = local_tzoffset()
+        key = (lat, lon, round(tzoffset, 2))
+        with cls._lock:
+            almanac = cls._almanacs.get(key)
+            if almanac is None:
+                almanac = cls(lat, lon, tzoffset)
+                cls._almanacs[key] = almanac
+        return almanac
+
+    @classmethod
+    def Table(cls, sunrise, sunset, solarnoon):
+        """Table array of the sun_batch() results of one location, None if the sun does not rise or set on some day"""
+        if (None in sunrise) or (None in sunset):
+            return None
+        table = array("i")
+        for times in zip(sunrise, sunset, solarnoon):
+            table.extend(decimal_day_seconds(t) for t in times)
+        return table
+
+    def Compute(self, day):
+        """Seconds from local midnight of (sunrise, sunset, solar noon) on a date"""
+        table = self.Table(*(times[0] for times in sun_batch([day], [self.lat], [self.lon], self.tzoffset)))
+        if table is None:
+            raise ValueError("The sun does not rise or set on %s" % day)
+        return tuple(table)
+
+    @classmethod
+    def Fill(cls, almanacs, start, days):
+        """Fill the tables of almanacs sharing one time zone offset with one sun_batch() pass"""
+        if start is None:
+            start = datetime.date.today()
+        dates = [start + datetime.timedelta(days=n) for n in range(days)]
+        results = sun_batch(dates, [a.lat for a in almanacs], [a.lon for a in almanacs], almanacs[0].tzoffset)
+        for almanac, sunrise, sunset, solarnoon in zip(almanacs, *results):
+            table = cls.Table(sunrise, sunset, solarnoon)
+            if table is not None:
+                almanac.table = (start.toordinal(), table)
+
+    def Precompute(self, start=None, days=366):
+        """
+        Fill the table for a range of dates
+
+        Parameters:
+            start (date): First date, None for today.
+            days (int): Number of dates, a year ahead by default.
+        """
+        self.Fill([self], start, days)
+
+    @classmethod
+    def PrecomputeMany(cls, locations, start=None, days=366):
+        """
+        Fill the tables of many locations in one pass
+
+        Locations where the sun does not rise or set on some day of the range
+        keep computing their days on first use.
+
+        Parameters:
+            locations (list): (lat, lon) tuples.
+            start (date): First date, None for today.
+            days (int): Number of dates, a year ahead by default.
+
+        Returns:
+            list: the almanacs of the locations
+        """
+        almanacs = [cls.Get(lat, lon) for lat, lon in locations]
+        if almanacs:
+            cls.Fill(almanacs, start, days)
+        return almanacs
+
+    def Seconds(self, day):
+        """Seconds from local midnight of (sunrise, sunset, solar noon) on a date, from the cache"""
+        table = self.table
+        if table is not None:
+            n = (day.toordinal() - table[0]) * self.FIELDS
+            if 0 <= n < len(table[1]):
+                return tuple(table[1][n:n + self.FIELDS])
+        times = self.days.get(day)
+        if times is None:
+            times = self.Compute(day)
+            self.days[day] = times
+        return times
+
+    def Day(self, when):
+        """
+        Sun times of the day of when
+
+        Parameters:
+            when (datetime): Local time, only its date is used.
+
+        Returns:
+            tuple: (sunrise, sunset, solar noon) as datetimes
+        """
+        midnight = datetime.datetime(when.year, when.month, when.day)
+        return tuple(midnight + datetime.timedelta(seconds=s) for s in self.Seconds(midnight.date()))
+
+    def Sunrise(self, when):
+        """Sunrise on the day of when"""
+        return self.Day(when)[0]
+
+    def Sunset(self, when):
+        """Sunset on the day of when"""
+        return self.Day(when)[1]
+
+    def SolarNoon(self, when):
+        """Solar noon on the day of when"""
+        return self.Day(when)[2]
@@ -1,7 +1,202 @@
 import os
-from PIL import Image, ImageOps, ImageEnhance
+from PIL import Image, ImageOps, ImageEnhance, ImageChops, ImageDraw
 import random
 import math
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import compress
+
+from p_weather.layout_plan import PlacedSprite
+
+
+class SpriteAtlas():
+    """
+    Decoded sprite images shared by every Sprites instance of the process.
+
+    All "<name>_<index>.png" files of a sprite directory are decoded once and
+    kept as palette-index images, keyed by (name, index).
+    Ready-to-composite variants (mirrored and/or tinted for a palette) are
+    built lazily and kept in a bounded LRU cache.
+    """
+
+    VARIANTS_MAX = 256
+
+    _atlases = {}
+    _lock = threading.Lock()
+
+    def __init__(self, spritesdir, ext):
+        self.dir = spritesdir
+        self.ext = ext
+        self.sprites = {}
+        self.masks = {}
+        self.variants = OrderedDict()
+        self.variants_lock = threading.Lock()
+        self.labels = {}
+        for filename in sorted(os.listdir(spritesdir)):
+            base, fileext = os.path.splitext(filename)
+            name, sep, index = base.rpartition("_")
+            if (fileext != ext) or (not sep) or (not index.isdigit()):
+                continue
+            self.Load(name, int(index))
+
+    @classmethod
+    def Get(cls, spritesdir, ext=".png"):
+        """Return the process-wide atlas of a sprite directory, decoding it on first use"""
+        key = (os.path.abspath(spritesdir), ext)
+        with cls._lock:
+            atlas = cls._atlases.get(key)
+            if atlas is None:
+                atlas = cls(spritesdir, ext)
+                cls._atlases[key] = atlas
+        return atlas
+
+    def Load(self, name, index):
+        imagefilename = "%s_%02i%s" % (name, index, self.ext)
+        img = Image.open(os.path.join(self.dir, imagefilename))
+        img.load()
+        self.sprites[(name, index)] = img
+        return img
+
+    def Image(self, name, index):
+        img = self.sprites.get((name, index))
+        if img is None:
+            img = self.Load(name, index)
+        return img
+
+    def Size(self, name, index):
+        return self.Image(name, index).size
+
+    def Mask(self, name, index, color):
+        """Return an "L" mask of the sprite pixels holding the given color index"""
+        key = (name, index, color)
+        mask = self.masks.get(key)
+        if mask is None:
+            img = self.Image(name, index)
+            indices = Image.frombytes("L", img.size, img.tobytes())
+            mask = indices.point(lambda v: 255 if v == color else 0)
+            self.masks[key] = mask
+        return mask
+
+    def Variant(self, key, build):
+        """
+        Return the cached variant stored under key, calling build() to make it on a miss
+
+        Parameters:
+            key: hashable - variant key, e.g. (name, index, ismirror, palette)
+            build: callable - returns the variant to cache
+        """
+        with self.variants_lock:
+            variant = self.variants.get(key)
+            if variant is not None:
+                self.variants.move_to_end(key)
+                return variant
+        variant = build()
+        with self.variants_lock:
+            self.variants[key] = variant
+            while len(self.variants) > self.VARIANTS_MAX:
+                self.variants.popitem(last=False)
+        return variant
+
+    def Label(self, key, build):
+        """Return the composed label stored under key, calling build() to make it on a miss"""
+        label = self.labels.get(key)
+        if label is None:
+            label = build()
+            self.labels[key] = label
+        return label
+
+
+class RainParticles():
+    """
+    Animated rain drops of one precipitation column
+
+    Drop state is kept as parallel arrays, one set per drop length, so the
+    positions of a frame are computed a whole array at a time.
+    """
+
+    LENGTHS = (2, 3, 4)  # drop lengths in pixels
+    SPEED_PX = 10        # pixels per frame at speed 1.0
+
+
+    def __init__(self, rng, count, xpos, ypos, width, tline, total_frames):
+        """
+        Parameters:
+            rng: random.Random - generator of the render
+            count: int - number of drops
+            xpos: int - first column of the rain
+            ypos: int - top of the rain
+            width: int - number of columns
+            tline: list - terrain line, drops splash on it
+            total_frames: int - number of frames in one animation loop
+        """
+        self.total_frames = total_frames
+        x = [xpos + rng.randrange(width) for _ in range(count)]
+        y0 = [ypos + rng.randrange(20) for _ in range(count)]  # Start position varies
+        length = [rng.choice(self.LENGTHS) for _ in range(count)]
+        step = [rng.uniform(0.8, 1.2) * self.SPEED_PX for _ in range(count)]  # Speed varies slightly between drops
+        start = [rng.randrange(total_frames) for _ in range(count)]  # Each drop gets a random start frame
+
+        # length -> (x, y0, step, start frame, ground) arrays
+        self.groups = {}
+        for n in self.LENGTHS:
+            sel = [l == n for l in length]
+            gx = array('h', compress(x, sel))
+            self.groups[n] = (gx,
+                              array('h', compress(y0, sel)),
+                              array('d', compress(step, sel)),
+                              array('h', compress(start, sel)),
+                              array('h', (tline[i] for i in gx)))
+
+
+    def __len__(self):
+        return sum(len(group[0]) for group in self.groups.values())
+
+
+    def Points(self, frame, splash_rng):
+        """
+        Pixels of all drops and splashes in a frame
+
+        Parameters:
+            frame: int - frame number
+            splash_rng: random.Random - generator deciding which landed drops splash
+
+        Returns:
+            tuple: (xs, ys) lists of pixel coordinates
+        """
+        total = self.total_frames
+        xs = []
+        ys = []
+        landed_x = []
+        landed_g = []
+        for n, (gx, gy0, gstep, gstart, gground) in self.groups.items():
+            if not gx:
+                continue
+            y = [y0 + ((frame - s) % total) * st for y0, s, st in zip(gy0, gstart, gstep)]
+            falling = [yy < g for yy, g in zip(y, gground)]
+
+            # A drop loops to the top after it reaches the terrain line
+            fx = list(compress(gx, falling))
+            fy = list(compress(y, falling))
+            for i in range(n):
+                xs += fx
+                ys += [int(yy - i) for yy in fy]
+
+            landed = [not f for f in falling]
+            landed_x += compress(gx, landed)
+            landed_g += compress(gground, landed)
+
+        # One random bit per landed drop decides if it splashes
+        if landed_x:
+            bits = splash_rng.getrandbits(len(landed_x))
+            splash = [(bits >> i) & 1 for i in range(len(landed_x))]
+            sx = list(compress(landed_x, splash))
+            sg = [g - 1 for g in compress(landed_g, splash)]
+            xs += [x - 1 for x in sx] + [x + 1 for x in sx]
+            ys += sg + sg
+        return xs, ys
+
+
 
 class Sprites():
 
@@ -31,77 +226,153 @@ class Sprites():
     
     PLASSPRITE = 10
     MINUSSPRITE = 11
+
+    # Extra palette index of an indexed canvas, holding the background color
+    BACKGROUND = 16
+
+    PALETTE_DARK = "dark"
+    PALETTE_LIGHT = "light"
+    PALETTE_INDEXED = "indexed"
+
+    # Color palettes for dark and light backgrounds
+    DARK_BG_PALETTE = {
+        BLACK: (180, 180, 180),   # Light gray for dark backgrounds
+        WHITE: (255, 255, 255),   # White
+        RED: (255, 60, 60),       # Bright red
+        BLUE: (80, 120, 255),     # Brighter blue
+        GREEN: (60, 220, 60),     # Bright green
+        YELLOW: (255, 255, 40),   # Yellow
+        ORANGE: (255, 165, 0),    # Orange
+        PURPLE: (200, 80, 220),   # Bright purple
+        CYAN: (0, 240, 255),      # Bright cyan
+        BROWN: (180, 120, 50),    # Light brown
+        PINK: (255, 130, 200),    # Bright pink
+        GRAY: (180, 180, 180),    # Light gray
+        LIGHT_GRAY: (230, 230, 230), # Very light gray
+        BRIGHT_BLUE: (30, 144, 255),  # Bright blue
+        BRIGHT_GREEN: (100, 255, 100)  # Bright green
+    }
+
+    LIGHT_BG_PALETTE = {
+        BLACK: (30, 30, 30),      # Dark gray for light backgrounds
+        WHITE: (250, 250, 250),   # Slightly off-white
+        RED: (200, 0, 0),         # Dark red
+        BLUE: (0, 0, 180),        # Dark blue
+        GREEN: (0, 120, 0),       # Dark green
+        YELLOW: (180, 180, 0),    # Dark yellow
+        ORANGE: (200, 100, 0),    # Dark orange
+        PURPLE: (100, 0, 120),    # Dark purple
+        CYAN: (0, 150, 200),      # Dark cyan
+        BROWN: (100, 50, 0),      # Dark brown
+        PINK: (200, 0, 100),      # Dark pink
+        GRAY: (100, 100, 100),    # Medium gray
+        LIGHT_GRAY: (150, 150, 150), # Medium-light gray
+        BRIGHT_BLUE: (0, 80, 160),  # Dark blue
+        BRIGHT_GREEN: (0, 150, 0)   # Dark green
+    }
     
     EXT = ".png"
     
 
-    def __init__(self, spritesdir, canvas):
-        self.img = canvas
-        self.pix = self.img.load()
+    def __init__(self, spritesdir, canvas, seed=None):
+        """
+        Parameters:
+            spritesdir: str - directory of the sprite images
+            canvas: Image - image to draw on
+            seed: int - seed of the random generator owned by this render,
+                        None for a random seed
+        """
+        self.SetCanvas(canvas)
         self.dir = spritesdir
         self.ext = self.EXT
-        self.w, self.h = self.img.size
+        self.atlas = SpriteAtlas.Get(spritesdir, self.ext)
         # Animation properties
         self.current_frame = 0
         self.total_frames = 1
+
+        # Every render owns its random generator, so concurrent renders don't disturb each other
+        if seed is None:
+            seed = random.randrange(1 << 32)
+        self.seed = seed
+        self.rng = random.Random(seed)
         
         # Initialize color palettes for both dark and light backgrounds
-        self.dark_bg_palette = {
-            self.BLACK: (180, 180, 180),   # Light gray for dark backgrounds
-            self.WHITE: (255, 255, 255),   # White
-            self.RED: (255, 60, 60),       # Bright red
-            self.BLUE: (80, 120, 255),     # Brighter blue
-            self.GREEN: (60, 220, 60),     # Bright green
-            self.YELLOW: (255, 255, 40),   # Yellow
-            self.ORANGE: (255, 165, 0),    # Orange
-            self.PURPLE: (200, 80, 220),   # Bright purple
-            self.CYAN: (0, 240, 255),      # Bright cyan
-            self.BROWN: (180, 120, 50),    # Light brown
-            self.PINK: (255, 130, 200),    # Bright pink
-            self.GRAY: (180, 180, 180),    # Light gray
-            self.LIGHT_GRAY: (230, 230, 230), # Very light gray
-            self.BRIGHT_BLUE: (30, 144, 255),  # Bright blue
-            self.BRIGHT_GREEN: (100, 255, 100)  # Bright green
-        }
-        
-        self.light_bg_palette = {
-            self.BLACK: (30, 30, 30),      # Dark gray for light backgrounds
-            self.WHITE: (250, 250, 250),   # Slightly off-white
-            self.RED: (200, 0, 0),         # Dark red
-            self.BLUE: (0, 0, 180),        # Dark blue
-            self.GREEN: (0, 120, 0),       # Dark green
-            self.YELLOW: (180, 180, 0),    # Dark yellow
-            self.ORANGE: (200, 100, 0),    # Dark orange
-            self.PURPLE: (100, 0, 120),    # Dark purple
-            self.CYAN: (0, 150, 200),      # Dark cyan
-            self.BROWN: (100, 50, 0),      # Dark brown
-            self.PINK: (200, 0, 100),      # Dark pink
-            self.GRAY: (100, 100, 100),    # Medium gray
-            self.LIGHT_GRAY: (150, 150, 150), # Medium-light gray
-            self.BRIGHT_BLUE: (0, 80, 160),  # Dark blue
-            self.BRIGHT_GREEN: (0, 150, 0)   # Dark green
-        }
+        self.dark_bg_palette = dict(self.DARK_BG_PALETTE)
+        self.light_bg_palette = dict(self.LIGHT_BG_PALETTE)
         
         # Default to dark background colors
         self.color_palette = self.dark_bg_palette.copy()
+        self.palette_name = self.PALETTE_DARK
         
         # Initialize rain animation data
-        self.rain_drops = []
+        self.rain_drops = {}  # key: (xpos, ypos, width) -> RainParticles
         
         # Store positions of static elements to keep them consistent across frames
         self.cloud_positions = {}  # key: (xpos, ypos, width) -> value: list of positions
         self.wind_positions = {}   # key: (speed, direction, xpos) -> value: positions, mirror states, etc.
 
 
+    def SetCanvas(self, canvas):
+        """
+        Draw on another image, keeping the colors, the random generator and the
+        cloud, wind and rain state, e.g. for the next frame of an animation
+        """
+        self.img = canvas
+        # An indexed ("P") canvas stores color indices, the palette is applied when encoding
+        self.indexed = (canvas.mode == "P")
+        self.pix = self.img.load()
+        self.draw = ImageDraw.Draw(self.img)
+        self.w, self.h = self.img.size
+
+
     def Dot(self, x, y, color):
         if (y>=self.h) or (x>=self.w) or (y<0) or (x<0):
             return
         
-        # If color is an index, convert it to RGB color
-        if isinstance(color, int) and color in self.color_palette:
-            self.pix[x,y] = self.color_palette[color]
-        else:
-            self.pix[x,y] = color
+        self.pix[x,y] = self.Color(color)
+
+    def Color(self, color):
+        """Resolve a color index to the canvas value: the index itself on an indexed canvas, RGB otherwise"""
+        if isinstance(color, int) and (not self.indexed) and (color in self.color_palette):
+            return self.color_palette[color]
+        return color
+
+    @property
+    def PaletteKey(self):
+        """Palette part of the sprite and label cache keys"""
+        return self.PALETTE_INDEXED if self.indexed else self.palette_name
+
+    @classmethod
+    def MakePalette(cls, is_dark_bg, bg_color):
+        """
+        Make the flat 256 color palette of an indexed canvas
+
+        Parameters:
+            is_dark_bg: bool - use the colors for a dark background
+            bg_color: tuple - RGB color of the BACKGROUND index
+        """
+        colors = cls.DARK_BG_PALETTE if is_dark_bg else cls.LIGHT_BG_PALETTE
+        palette = []
+        for index in range(256):
+            if index == cls.BACKGROUND:
+                palette.extend(bg_color)
+            else:
+                palette.extend(colors.get(index, (0, 0, 0)))
+        return palette
+
+    def DrawPoints(self, xs, ys, color):
+        """
+        Draw a batch of single pixels in one call, points outside the canvas are clipped
+
+        Parameters:
+            xs: iterable - x coordinates
+            ys: iterable - y coordinates, paired with xs
+            color: int palette index or RGB tuple
+        """
+        color = self.Color(color)
+        points = list(zip(xs, ys))
+        if points:
+            self.draw.point(points, fill=color)
 
     def get_color_by_name(self, name, index):
         """Determine appropriate color based on sprite name"""
@@ -130,35 +401,38 @@ class Sprites():
         else:
             return self.WHITE  # Default to white instead of black
 
+    def MakeVariant(self, name, index, ismirror):
+        """Build the (sprite, mask) pair of a sprite tinted with the current palette, in the canvas mode"""
+        color_id = self.get_color_by_name(name, index)
+        size = self.atlas.Size(name, index)
+        sprite = Image.new(self.img.mode, size)
+        mask = Image.new("L", size)
+        for sprite_color, rgb in ((self.BLACK, self.Color(color_id)),
+                                  (self.WHITE, self.Color(self.WHITE)),
+                                  (self.RED, self.Color(self.RED))):
+            color_mask = self.atlas.Mask(name, index, sprite_color)
+            sprite.paste(rgb, (0, 0), color_mask)
+            mask.paste(255, (0, 0), color_mask)
+        if (ismirror):
+            sprite = ImageOps.mirror(sprite)
+            mask = ImageOps.mirror(mask)
+        return (sprite, mask)
+
     def Draw(self, name, index, xpos, ypos, ismirror=False):
         if (xpos<0) or (ypos<0):
             return 0
-    
-        imagefilename = "%s_%02i%s" % (name, index, self.ext)
-        imagepath = os.path.join(self.dir, imagefilename) 
-        img = Image.open(imagepath)
-        
-        # Get appropriate color for this sprite
-        color_id = self.get_color_by_name(name, index)
-        color = self.color_palette[color_id]
-        
-        if (ismirror):
-            img = ImageOps.mirror(img)
-        w, h = img.size
-        pix = img.load()
-        ypos -= h
-        for x in range(w):
-            for y in range(h):
-                if (xpos+x>=self.w) or (xpos+x<0):
-                    continue
-                if (ypos+y>=self.h) or (ypos+y<0):
-                    continue
-                if (pix[x,y]==self.BLACK):
-                    self.pix[xpos+x, ypos+y] = color  # Use the RGB color directly
-                elif (pix[x,y]==self.WHITE):
-                    self.pix[xpos+x, ypos+y] = self.color_palette[self.WHITE]
-                elif (pix[x,y]==self.RED):
-                    self.pix[xpos+x, ypos+y] = self.color_palette[self.RED]
+
+        key = (name, index, bool(ismirror), self.PaletteKey)
+        sprite, mask = self.atlas.Variant(key, lambda: self.MakeVariant(name, index, ismirror))
+
+        w, h = sprite.size
+        x0 = math.floor(xpos)
+        y0 = math.floor(ypos - h)
+        if (x0>=self.w) or (y0>=self.h) or (x0+w<=0) or (y0+h<=0):
+            return w
+
+        # paste() clips the sprite to the canvas
+        self.img.paste(sprite, (x0, y0), mask)
 
         return w
 
@@ -167,41 +441,78 @@ class Sprites():
     DIGITMINUS = 11
     DIGITSEMICOLON = 12
 
-    def DrawInt(self,n,xpos,ypos,issign=True,mindigits=1):
-        n = round(n)
+    LABELMIN = -60
+    LABELMAX = 130
+
+    def DrawInt_layout(self,n,issign,mindigits,draw):
+        """Lay out the digits of a rounded integer, draw(index,dx) places a digit and returns its width"""
         if (n<0):
             sign = self.DIGITMINUS
         else:
             sign = self.DIGITPLAS
-        n = round(n)
         n = abs(n)
         n0 = int( n / 100 )
         n1 = int( (n % 100) / 10 )
         n2 = n % 10
         dx = 0
         if (issign) or (sign == self.DIGITMINUS):
-            w = self.Draw("digit",sign,xpos+dx,ypos)
+            w = draw(sign,dx)
             dx+=w+1
         if (n0!=0) or (mindigits>=3):
-            w = self.Draw("digit",n0,xpos+dx,ypos)
+            w = draw(n0,dx)
             dx+=w
             if (n0!=1):
                 dx+=1
         if (n1!=0) or (n0!=0)  or (mindigits>=2):
             if (n1==1):
                 dx -=1
-            w = self.Draw("digit",n1,xpos+dx,ypos)
+            w = draw(n1,dx)
             dx+=w
             if (n1!=1):
                 dx+=1
         if (n2==1):
             dx -=1                
-        w = self.Draw("digit",n2,xpos+dx,ypos)
+        w = draw(n2,dx)
         dx+=w
         if (n2!=1):
             dx +=1                
         return dx
 
+    def MakeLabel(self,n,issign,mindigits):
+        """Compose the digits of a label into one (strip, mask, x offset, width) entry"""
+        glyphs = []
+        def place(index,dx):
+            glyphs.append((index,dx))
+            return self.atlas.Size("digit",index)[0]
+        width = self.DrawInt_layout(n,issign,mindigits,place)
+
+        x0 = min(dx for _, dx in glyphs)
+        x1 = max(dx+self.atlas.Size("digit",index)[0] for index, dx in glyphs)
+        h = max(self.atlas.Size("digit",index)[1] for index, _ in glyphs)
+        strip = Image.new(self.img.mode, (x1-x0, h))
+        mask = Image.new("L", (x1-x0, h))
+        for index, dx in glyphs:
+            key = ("digit", index, False, self.PaletteKey)
+            sprite, spritemask = self.atlas.Variant(key, lambda: self.MakeVariant("digit", index, False))
+            offset = (dx-x0, h-sprite.height)
+            strip.paste(sprite, offset, spritemask)
+            mask.paste(255, offset, spritemask)
+        return (strip, mask, x0, width)
+
+    def DrawInt(self,n,xpos,ypos,issign=True,mindigits=1):
+        n = round(n)
+
+        # Labels of the usual temperature/clock range are composed once and blitted whole
+        if (self.LABELMIN<=n<=self.LABELMAX) and (ypos>=0):
+            key = (n, bool(issign), mindigits, self.PaletteKey)
+            strip, mask, x0, width = self.atlas.Label(key, lambda: self.MakeLabel(n,issign,mindigits))
+            if (xpos+x0>=0):
+                self.img.paste(strip, (math.floor(xpos)+x0, math.floor(ypos-strip.height)), mask)
+                return width
+
+        return self.DrawInt_layout(n,issign,mindigits,
+                                   lambda index,dx: self.Draw("digit",index,xpos+dx,ypos))
+
     def DrawClock(self,xpos,ypos,h,m):
         dx=0
         w = self.DrawInt(h,xpos+dx,ypos,False,2)
@@ -218,8 +529,13 @@ class Sprites():
 
     def DrawCloud(self, persent, xpos, ypos, width, height, animate=False):
         """Draw clouds with consistent positions across animation frames"""
+        for cloud in self.PlaceCloud(persent, xpos, ypos, width):
+            self.Draw(cloud.name, cloud.index, cloud.x, cloud.y)
+
+    def PlaceCloud(self, persent, xpos, ypos, width):
+        """Return the cloud sprites for a cloud cover, placed once per configuration"""
         if (persent<2):
-            return
+            return []
         elif (persent<5):
             cloudset = [2]
         elif (persent<10):
@@ -250,73 +566,100 @@ class Sprites():
         if cloud_key not in self.cloud_positions:
             positions = []
             for c in cloudset:
-                pos_x = xpos + random.randrange(width)
-                positions.append((c, pos_x))
+                pos_x = xpos + self.rng.randrange(width)
+                positions.append(PlacedSprite("cloud", c, pos_x, ypos))
             self.cloud_positions[cloud_key] = positions
         
         # Use pre-generated positions to ensure consistency across frames
-        for c, pos_x in self.cloud_positions[cloud_key]:
-            self.Draw("cloud", c, pos_x, ypos)
+        return self.cloud_positions[cloud_key]
         
+    def RandomMask(self, size, probability):
+        """Return an "L" mask with each pixel set to 255 with the given probability"""
+        w, h = size
+        # 16 bit uniform values from two random bytes per pixel, compared against
+        # the threshold as (high byte, low byte) pairs
+        if (probability >= 1.0):
+            return Image.new("L", size, 255)
+        threshold = int((1.0 - probability) * 65536) + 1
+        if (threshold >= 65536):
+            return Image.new("L", size)
+        t_hi, t_lo = divmod(threshold, 256)
+        hi = Image.frombytes("L", size, self.rng.randbytes(w * h))
+        lo = Image.frombytes("L", size, self.rng.randbytes(w * h))
+        above = hi.point(lambda v: 255 if v > t_hi else 0)
+        equal = hi.point(lambda v: 255 if v == t_hi else 0)
+        low_ok = lo.point(lambda v: 255 if v >= t_lo else 0)
+        return ImageChops.lighter(above, ImageChops.multiply(equal, low_ok))
+
+    def DrawPrecipitation_field(self, probability, xpos, ypos, width, tline):
+        """
+        Make the random drop field of a static rain/snow column in one pass
+
+        Drops sit on every second row from ypos down to the terrain line, each one
+        present with the given probability.
+
+        Returns:
+            tuple: (x0, drops, terrain) - left canvas column, "L" mask of the drop rows
+                   stretched to two pixels each, "L" mask of the area above the terrain
+                   line; None if there is nothing to draw
+        """
+        if (probability <= 0):
+            return None
+        x0 = max(xpos, 0)
+        x1 = min(xpos + width, self.w)
+        if (x1 <= x0):
+            return None
+        heights = [min(tline[x], self.h) - ypos for x in range(x0, x1)]
+        rows = (max(heights) + 1) // 2
+        if (rows <= 0):
+            return None
+
+        w = x1 - x0
+        rowlimit = Image.new("L", (w, rows))
+        terrain = Image.new("L", (w, 2 * rows))
+        rowdraw = ImageDraw.Draw(rowlimit)
+        terraindraw = ImageDraw.Draw(terrain)
+        for i, height in enumerate(heights):
+            if (height > 0):
+                rowdraw.line([(i, 0), (i, (height + 1) // 2 - 1)], fill=255)
+                terraindraw.line([(i, 0), (i, height - 1)], fill=255)
+
+        drops = ImageChops.multiply(self.RandomMask((w, rows), probability), rowlimit)
+        drops = drops.resize((w, 2 * rows), Image.NEAREST)
+        return (x0, drops, terrain)
+
     HEAVYRAIN = 5.0
     RAINFACTOR = 20
 
+    @staticmethod
+    def RainDropCount(value, width):
+        """Number of animated rain drops over width columns"""
+        return int(width * value * 2)  # Number of drops based on rain intensity
+
     def DrawRain(self, value, xpos, ypos, width, tline, animate=False):
         """Draw rain with optional animation"""
         ypos += 1
         r = 1.0 - (value / self.HEAVYRAIN) / self.RAINFACTOR
-        bright_blue = self.color_palette[self.BRIGHT_BLUE]  # Brighter blue for rain visibility
+        bright_blue = self.Color(self.BRIGHT_BLUE)  # Brighter blue for rain visibility
         
-        # If we're animating, initialize rain drops on first frame
-        if animate and not self.rain_drops:
-            # Generate rain drops
-            drop_count = int(width * value * 2)  # Number of drops based on rain intensity
-            for _ in range(drop_count):
-                # Random position and animation timing
-                drop_x = xpos + random.randrange(width)
-                drop_y_start = ypos + random.randrange(20)  # Start position varies
-                drop_length = random.randint(2, 4)  # Longer raindrops for better visibility
-                # Speed varies slightly between frames
-                speed = random.uniform(0.8, 1.2)
-                # Each raindrop gets a random start frame
-                start_frame = random.randrange(self.total_frames)
-                
-                self.rain_drops.append({
-                    'x': drop_x,
-                    'y': drop_y_start,
-                    'length': drop_length,
-                    'speed': speed,
-                    'start_frame': start_frame
-                })
-                
         if animate:
-            # Draw animated raindrops
-            for drop in self.rain_drops:
-                # Only draw if raindrop is active in this frame
-                frame_offset = (self.current_frame - drop['start_frame']) % self.total_frames
-                # Calculate position based on current frame
-                drop_y = drop['y'] + (frame_offset * drop['speed'] * 10)
-                
-                # Loop the raindrop if it goes below the terrain line
-                if drop_y >= tline[drop['x']]:
-                    # Create splash effect
-                    if random.random() > 0.5:
-                        self.Dot(drop['x'] - 1, tline[drop['x']] - 1, bright_blue)
-                        self.Dot(drop['x'] + 1, tline[drop['x']] - 1, bright_blue)
-                    continue
-                    
-                # Draw the raindrop
-                for i in range(drop['length']):
-                    self.Dot(drop['x'], int(drop_y - i), bright_blue)
+            # Drops of a column are generated on first use and kept for every frame
+            key = (xpos, ypos, width)
+            drops = self.rain_drops.get(key)
+            if drops is None:
+                drops = RainParticles(self.rng, self.RainDropCount(value, width), xpos, ypos, width, tline, self.total_frames)
+                self.rain_drops[key] = drops
+
+            # Splashes vary per frame and column but must not shift the layout stream of self.rng
+            splash_rng = random.Random((self.seed * self.total_frames + self.current_frame) * self.w + xpos)
+            xs, ys = drops.Points(self.current_frame, splash_rng)
+            self.DrawPoints(xs, ys, bright_blue)
         else:
-            # Draw static rain (original implementation)
-            for x in range(xpos, xpos + width):
-                for y in range(ypos, tline[x], 2):
-                    if (x >= self.w) or (y >= self.h): 
-                        continue
-                    if (random.random() > r):
-                        self.pix[x, y] = bright_blue
-                        self.pix[x, y-1] = bright_blue
+            # Draw static rain, each drop is two pixels ending at its row
+            field = self.DrawPrecipitation_field(1.0 - r, xpos, ypos, width, tline)
+            if field is not None:
+                x0, drops, _ = field
+                self.img.paste(bright_blue, (x0, ypos - 1), drops)
         
     HEAVYSNOW = 5.0
     SNOWFACTOR = 10
@@ -324,19 +667,13 @@ class Sprites():
     def DrawSnow(self, value, xpos, ypos, width, tline):
         ypos+=1
         r = 1.0 - (value / self.HEAVYSNOW) / self.SNOWFACTOR 
-        cyan_color = self.color_palette[self.CYAN]  # Bright cyan for snow
-
-        for x in range(xpos, xpos + width):
-            for y in range(ypos, tline[x], 2):
-                if (x >= self.w): 
-                    continue
-                if (y >= self.h): 
-                    continue
-                if (random.random() > r):
-                    self.pix[x, y] = cyan_color
-                    # Add second pixel to make snow more visible
-                    if (y+1 < tline[x]):
-                        self.pix[x, y+1] = cyan_color
+        cyan_color = self.Color(self.CYAN)  # Bright cyan for snow
+
+        # Second pixel below each flake makes snow more visible, but never under the terrain line
+        field = self.DrawPrecipitation_field(1.0 - r, xpos, ypos, width, tline)
+        if field is not None:
+            x0, drops, terrain = field
+            self.img.paste(cyan_color, (x0, ypos), ImageChops.multiply(drops, terrain))
 
     def DrawWind_degdist(self, deg1, deg2):
         h = max(deg1, deg2)
@@ -355,8 +692,17 @@ class Sprites():
             for i in range(0, count[n]):
                 list.append(name)
 
-    def DrawWind(self, speed, direction, xpos, tline, animate=False):
-        """Draw wind with consistent tree positions across animation frames"""
+    def DrawWind(self, speed, direction, xpos, tline, animate=False, blocked=None):
+        """
+        Draw wind with consistent tree positions across animation frames
+
+        Trees are not planted where the optional blocked mask is set.
+        """
+        for tree in self.PlaceWind(speed, direction, xpos, tline, blocked):
+            self.Draw(tree.name, tree.index, tree.x, tree.y, tree.mirror)
+
+    def PlaceWind(self, speed, direction, xpos, tline, blocked=None):
+        """Return the tree sprites for a wind speed and direction, placed once per wind"""
         wind_key = (speed, direction, xpos)
         
         # If this is the first time drawing this wind or not animating, generate positions
@@ -367,10 +713,9 @@ class Sprites():
             self.DrawWind_dirsprite(direction, 180, "palm", list)
             self.DrawWind_dirsprite(direction, 270, "tree", list)
 
-            # Set the random seed based on the wind parameters for consistent shuffling
-            random_seed = int(speed * 1000 + direction)
-            random.seed(random_seed)
-            random.shuffle(list)
+            # Seed a local generator from the wind parameters for consistent shuffling
+            rnd = random.Random(int(speed * 1000 + direction))
+            rnd.shuffle(list)
 
             windindex = None
             if (speed <= 0.4):
@@ -393,9 +738,9 @@ class Sprites():
                 windindex = [3, 3, 3, 3]
                 
             if windindex is None:
-                return
+                return []
                 
-            random.shuffle(windindex)
+            rnd.shuffle(windindex)
             
             # Store all positioning data for trees
             tree_data = []
@@ -404,9 +749,9 @@ class Sprites():
             
             for i in windindex:
                 # Use deterministic "random" offsets based on wind parameters
-                random.seed(ix * 1000 + j + int(speed * 100))
-                xx = ix + random.randint(-1, 1)
-                ismirror = random.random() < 0.5
+                rnd = random.Random(ix * 1000 + j + int(speed * 100))
+                xx = ix + rnd.randint(-1, 1)
+                ismirror = rnd.random() < 0.5
                 offset = xx + 5
 
                 if (offset >= len(tline)):
@@ -415,33 +760,33 @@ class Sprites():
                 if (ismirror):
                     xx -= 16
 
-                tree_data.append({
-                    'type': list[j],
-                    'index': i,
-                    'x': xx,
-                    'y': tline[offset] + 1,
-                    'mirror': ismirror
-                })
+                if (blocked is not None) and blocked[offset]:
+                    yy = self.DISABLED
+                else:
+                    yy = tline[offset] + 1
+
+                tree_data.append(PlacedSprite(list[j], i, xx, yy, ismirror))
                 ix += 9
                 j += 1
             
             self.wind_positions[wind_key] = tree_data
         
-        # Draw trees using stored positions for consistent placement
-        for tree in self.wind_positions[wind_key]:
-            self.Draw(
-                tree['type'], 
-                tree['index'], 
-                tree['x'], 
-                tree['y'], 
-                tree['mirror']
-            )
+        # Use stored positions for consistent placement
+        return self.wind_positions[wind_key]
 
     SMOKE_R_PX = 30
     PERSENT_DELTA = 4
     SMOKE_SIZE = 60
+    SMOKE_ANGLE_STEP = 0.5  # degrees, smoke curves are memoized per step
+    SMOKE_SEED = 1000
+    SMOKE_CACHE_MAX = 4096
 
-    def DrawSmoke_makeline(self, angle_deg):
+    # Process-wide memoized smoke geometry, see DrawSmoke_points()
+    _smoke_lines = {}
+    _smoke_points = {}
+    _smoke_jitter = None
+
+    def DrawSmoke_calcline(self, angle_deg):
         a = (math.pi * angle_deg) / 180
         r = self.SMOKE_R_PX
         k = r * math.sin(a) / (math.sqrt((r * math.cos(a)))) 
@@ -454,69 +799,109 @@ class Sprites():
             yi = yp
             while(True):
                 rr = math.sqrt(x*x + yi*yi)
-                dots.append([x, yi, rr])
+                dots.append((x, yi, rr))
                 if (rr > self.SMOKE_SIZE):
-                    return dots
+                    return tuple(dots)
                 yi += 1
                 if (yi >= y):
                     yp = y
                     break
+        return tuple(dots)
 
-    def DrawSmoke(self, x0, y0, persent, animate=False):
-        """Draw smoke with optional animation"""
-        light_gray_color = self.color_palette[self.LIGHT_GRAY]  # Light gray for better visibility on black
-        
-        # If animating, adjust the angle slightly based on the frame
+    def DrawSmoke_quantize(self, angle_deg):
+        angle_deg = min(max(angle_deg, 0), 90)
+        return round(angle_deg / self.SMOKE_ANGLE_STEP)
+
+    def DrawSmoke_makeline(self, angle_deg):
+        """Return the (x, y, r) dots of the smoke curve, memoized per quantized angle"""
+        key = (self.DrawSmoke_quantize(angle_deg), self.w, self.h)
+        dots = Sprites._smoke_lines.get(key)
+        if dots is None:
+            dots = self.DrawSmoke_calcline(key[0] * self.SMOKE_ANGLE_STEP)
+            if (len(Sprites._smoke_lines) >= self.SMOKE_CACHE_MAX):
+                Sprites._smoke_lines.clear()
+            Sprites._smoke_lines[key] = dots
+        return dots
+
+    def DrawSmoke_jitter(self):
+        """
+        Per-position smoke jitter: None where no dot is drawn, (dx, dy) otherwise
+
+        The table is generated once per process from its own random generator, so a
+        dot keeps its jitter in every frame and the global random state is untouched.
+        """
+        jitter = Sprites._smoke_jitter
+        if jitter is None:
+            rnd = random.Random(self.SMOKE_SEED)
+            size = self.SMOKE_SIZE + 2
+            jitter = []
+            for x in range(size):
+                column = []
+                for y in range(size):
+                    r = math.sqrt(x*x + y*y)
+                    if rnd.random()*1.3 > (r/self.SMOKE_SIZE):
+                        if rnd.random()*1.2 < (r/self.SMOKE_SIZE):
+                            column.append((rnd.randint(-1, 1), rnd.randint(-1, 1)))
+                        else:
+                            column.append((0, 0))
+                    else:
+                        column.append(None)
+                jitter.append(column)
+            Sprites._smoke_jitter = jitter
+        return jitter
+
+    def DrawSmoke_points(self, persent, frame, total_frames):
+        """
+        Smoke dots of one frame relative to the chimney, memoized per (angle, frame)
+
+        Returns:
+            tuple: (dx, dy) canvas offsets of the dots
+        """
+        animate = total_frames > 1
         if animate:
-            # Add a slight wave effect to the smoke angle
-            angle_adjustment = math.sin(self.current_frame / self.total_frames * 2 * math.pi) * 5
-            dots = self.DrawSmoke_makeline(persent + angle_adjustment)
-            
-            # Use consistent randomization across frames
-            random.seed(x0 * 1000 + y0)
-            offset_x = int(math.sin(self.current_frame / self.total_frames * 2 * math.pi) * 3)
+            # Add a slight wave effect to the smoke angle and position
+            wave = math.sin(frame / total_frames * 2 * math.pi)
+            angle = self.DrawSmoke_quantize(persent) * self.SMOKE_ANGLE_STEP + wave * 5
+            offset_x = int(wave * 3)
         else:
-            dots = self.DrawSmoke_makeline(persent)
+            angle = persent
             offset_x = 0
-            
-        # Store the random state to restore it later
-        if animate:
-            random_state = random.getstate()
-        
-        for d in dots:
-            x = d[0]
-            y = d[1]
-            r = d[2]
-            
-            # Use frame number to determine which parts of smoke to render in this frame
-            if animate:
-                # Different parts of smoke appear in different frames
-                smoke_phase = (x + y + self.current_frame) % self.total_frames
-                if smoke_phase > self.total_frames / 2:
-                    continue
-                    
-            # Use consistent random seed for each dot's position
-            if animate:
-                # Consistent random seed for each position
-                random.seed(x * 1000 + y * 1000 + int(persent * 100))
-                
-            if random.random()*1.3 > (r/self.SMOKE_SIZE):
-                if random.random()*1.2 < (r/self.SMOKE_SIZE):
-                    dx = random.randint(-1, 1)
-                    dy = random.randint(-1, 1)
-                else:
-                    dx = 0
-                    dy = 0
-                
-                # Apply the animated horizontal offset if animating
-                if animate:
-                    dx += offset_x
-                
-                self.Dot(x0+x+dx, self.h-(y0+y)+dy, light_gray_color)
-                
-        # Restore the random state
+
+        key = (self.DrawSmoke_quantize(persent), frame, total_frames, self.w, self.h)
+        points = Sprites._smoke_points.get(key)
+        if points is not None:
+            return points
+
+        jitter = self.DrawSmoke_jitter()
+        points = []
+        for x, y, r in self.DrawSmoke_makeline(angle):
+            # Different parts of smoke appear in different frames
+            if animate and ((x + y + frame) % total_frames > total_frames / 2):
+                continue
+            if (x >= len(jitter)) or (y >= len(jitter)):
+                continue
+            d = jitter[x][y]
+            if d is None:
+                continue
+            points.append((x + d[0] + offset_x, d[1] - y))
+        points = tuple(points)
+
+        if (len(Sprites._smoke_points) >= self.SMOKE_CACHE_MAX):
+            Sprites._smoke_points.clear()
+        Sprites._smoke_points[key] = points
+        return points
+
+    def DrawSmoke(self, x0, y0, persent, animate=False):
+        """Draw smoke with optional animation"""
+        light_gray_color = self.Color(self.LIGHT_GRAY)  # Light gray for better visibility on black
+
         if animate:
-            random.setstate(random_state)
+            points = self.DrawSmoke_points(persent, self.current_frame, self.total_frames)
+        else:
+            points = self.DrawSmoke_points(persent, 0, 1)
+
+        y0 = self.h - y0
+        self.DrawPoints([x0 + dx for dx, _ in points], [y0 + dy for _, dy in points], light_gray_color)
 
     def adjust_colors_for_background(self, is_dark_bg):
         """
@@ -527,8 +912,10 @@ class Sprites():
         """
         if is_dark_bg:
             self.color_palette = self.dark_bg_palette.copy()
+            self.palette_name = self.PALETTE_DARK
         else:
             self.color_palette = self.light_bg_palette.copy()
+            self.palette_name = self.PALETTE_LIGHT
 
 if __name__ == "__main__":  
     img = Image.open('../test.bmp')
@@ -16,13 +16,16 @@ class sun:
  import sunrise 
  s = sun(lat=49,long=3) 
  print('sunrise at ',s.sunrise(when=datetime.datetime.now()) 
+ 
+ Nothing is stored on the instance while calculating, so one sun can be 
+ shared by several threads. See sun_batch() for many days and places. 
  """  
  def __init__(self,lat=50.4546600,long=30.5238000): # default Kyiv  
   self.lat=lat  
   self.long=long
-  self.tzoffset = ( datetime.now() - datetime.utcnow() ).total_seconds()/(60*60)
+  self.tzoffset = local_tzoffset()
     
- def sunrise(self,when=None):  
+ def sunrise(self,when=None):
   """ 
   return the time of sunrise as a datetime.time object 
   when is a datetime.datetime object. If none is given 
@@ -30,21 +33,15 @@ class sun:
   if present) 
   """  
   if when is None : when = datetime.now()  
-  self.__preptime(when)  
-  self.__calc()  
-  return sun.__timefromdecimalday(self.sunrise_t,when)  
+  return sun.__timefromdecimalday(self.__calc(when)[0],when)  
     
  def sunset(self,when=None):  
   if when is None : when = datetime.now()  
-  self.__preptime(when)  
-  self.__calc()  
-  return sun.__timefromdecimalday(self.sunset_t,when)  
+  return sun.__timefromdecimalday(self.__calc(when)[1],when)  
     
  def solarnoon(self,when=None):  
   if when is None : when = datetime.now()  
-  self.__preptime(when)  
-  self.__calc()  
-  return sun.__timefromdecimalday(self.solarnoon_t,when)  
+  return sun.__timefromdecimalday(self.__calc(when)[2],when)  
    
  @staticmethod  
  def __timefromdecimalday(day,when):  
@@ -56,58 +53,143 @@ class sun:
   s      = int(seconds)  
   return datetime(when.year, when.month, when.day, h, m, s)
   
- def __preptime(self,when):  
+ @staticmethod  
+ def __preptime(when):  
   """ 
   Extract information in a suitable format from when,  
   a datetime.datetime object. 
+  
+  Returns (day, daytime), see solar_position() 
   """  
   # datetime days are numbered in the Gregorian calendar  
   # while the calculations from NOAA are distibuted as  
   # OpenOffice spreadsheets with days numbered from  
   # 1/1/1900. The difference are those numbers taken for   
   # 18/12/2010  
-  self.day = when.toordinal()-(734124-40529)  
+  day = when.toordinal()-(734124-40529)  
   t=when.time()  
-  self.time= (t.hour + t.minute/60.0 + t.second/3600.0)/24.0  
-    
-  self.timezone=self.tzoffset
+  time= (t.hour + t.minute/60.0 + t.second/3600.0)/24.0  
+  return day,time
  
     
- def __calc(self):  
+ def __calc(self,when):  
   """ 
   Perform the actual calculations for sunrise, sunset and 
-  a number of related quantities. 
+  solar noon. 
    
-  The results are stored in the instance variables 
-  sunrise_t, sunset_t and solarnoon_t 
+  Returns (sunrise_t, sunset_t, solarnoon_t) in decimal days 
   """  
-  timezone = self.timezone # in hours, east is positive  
-  longitude= self.long     # in decimal degrees, east is positive  
-  latitude = self.lat      # in decimal degrees, north is positive  
+  timezone = self.tzoffset # in hours, east is positive  
+  day,daytime = sun.__preptime(when)  
+  declination,eqtime = solar_position(day,daytime,timezone)  
+  return day_times(declination,eqtime,self.lat,self.long,timezone)  
   
-  time  = self.time # percentage past midnight, i.e. noon  is 0.5  
-  day      = self.day     # daynumber 1=1/1/1900  
-   
-  Jday     =day+2415018.5+time-timezone/24 # Julian day  
-  Jcent    =(Jday-2451545)/36525    # Julian century  
+
+def local_tzoffset():  
+ """ local time zone offset in hours, east is positive """  
+ return ( datetime.now() - datetime.utcnow() ).total_seconds()/(60*60)
+
+
+def solar_position(day,daytime,timezone):  
+ """ 
+ Declination of the sun in degrees and the equation of time in minutes 
+ 
+ day is the daynumber, 1=1/1/1900, daytime the percentage past midnight 
+ (noon is 0.5) and timezone the offset in hours, east is positive. 
+ """  
+ Jday     =day+2415018.5+daytime-timezone/24 # Julian day  
+ Jcent    =(Jday-2451545)/36525    # Julian century  
   
-  Manom    = 357.52911+Jcent*(35999.05029-0.0001537*Jcent)  
-  Mlong    = 280.46646+Jcent*(36000.76983+Jcent*0.0003032)%360  
-  Eccent   = 0.016708634-Jcent*(0.000042037+0.0001537*Jcent)  
-  Mobliq   = 23+(26+((21.448-Jcent*(46.815+Jcent*(0.00059-Jcent*0.001813))))/60)/60  
-  obliq    = Mobliq+0.00256*cos(rad(125.04-1934.136*Jcent))  
-  vary     = tan(rad(obliq/2))*tan(rad(obliq/2))  
-  Seqcent  = sin(rad(Manom))*(1.914602-Jcent*(0.004817+0.000014*Jcent))+sin(rad(2*Manom))*(0.019993-0.000101*Jcent)+sin(rad(3*Manom))*0.000289  
-  Struelong= Mlong+Seqcent  
-  Sapplong = Struelong-0.00569-0.00478*sin(rad(125.04-1934.136*Jcent))  
-  declination = deg(asin(sin(rad(obliq))*sin(rad(Sapplong))))  
+ Manom    = 357.52911+Jcent*(35999.05029-0.0001537*Jcent)  
+ Mlong    = 280.46646+Jcent*(36000.76983+Jcent*0.0003032)%360  
+ Eccent   = 0.016708634-Jcent*(0.000042037+0.0001537*Jcent)  
+ Mobliq   = 23+(26+((21.448-Jcent*(46.815+Jcent*(0.00059-Jcent*0.001813))))/60)/60  
+ obliq    = Mobliq+0.00256*cos(rad(125.04-1934.136*Jcent))  
+ vary     = tan(rad(obliq/2))*tan(rad(obliq/2))  
+ Seqcent  = sin(rad(Manom))*(1.914602-Jcent*(0.004817+0.000014*Jcent))+sin(rad(2*Manom))*(0.019993-0.000101*Jcent)+sin(rad(3*Manom))*0.000289  
+ Struelong= Mlong+Seqcent  
+ Sapplong = Struelong-0.00569-0.00478*sin(rad(125.04-1934.136*Jcent))  
+ declination = deg(asin(sin(rad(obliq))*sin(rad(Sapplong))))  
     
-  eqtime   = 4*deg(vary*sin(2*rad(Mlong))-2*Eccent*sin(rad(Manom))+4*Eccent*vary*sin(rad(Manom))*cos(2*rad(Mlong))-0.5*vary*vary*sin(4*rad(Mlong))-1.25*Eccent*Eccent*sin(2*rad(Manom)))  
-  
-  hourangle= deg(acos(cos(rad(90.833))/(cos(rad(latitude))*cos(rad(declination)))-tan(rad(latitude))*tan(rad(declination))))  
+ eqtime   = 4*deg(vary*sin(2*rad(Mlong))-2*Eccent*sin(rad(Manom))+4*Eccent*vary*sin(rad(Manom))*cos(2*rad(Mlong))-0.5*vary*vary*sin(4*rad(Mlong))-1.25*Eccent*Eccent*sin(2*rad(Manom)))  
+ return declination,eqtime
+
+
+def day_times(declination,eqtime,latitude,longitude,timezone):  
+ """ 
+ Sunrise, sunset and solar noon of one place in decimal days 
+ 
+ latitude and longitude are in decimal degrees, north and east are 
+ positive. Raises ValueError if the sun does not rise or set that day. 
+ """  
+ hourangle= deg(acos(cos(rad(90.833))/(cos(rad(latitude))*cos(rad(declination)))-tan(rad(latitude))*tan(rad(declination))))  
   
-  self.solarnoon_t=(720-4*longitude-eqtime+timezone*60)/1440  
-  self.sunrise_t  =self.solarnoon_t-hourangle*4/1440  
-  self.sunset_t   =self.solarnoon_t+hourangle*4/1440  
+ solarnoon_t=(720-4*longitude-eqtime+timezone*60)/1440  
+ sunrise_t  =solarnoon_t-hourangle*4/1440  
+ sunset_t   =solarnoon_t+hourangle*4/1440  
+ return sunrise_t,sunset_t,solarnoon_t
+
+
+def sun_batch(dates,latitudes,longitudes,timezone=None,daytime=0.5):  
+ """ 
+ Sunrise, sunset and solar noon of many days at many places in one pass 
+ 
+ The position of the sun depends on the day only and is calculated once 
+ per day, every place then only adds its hour angle. The results are the 
+ same as the ones of sun. Nothing is shared between calls, so batches 
+ can run in several threads. 
+ 
+ dates is a sequence of datetime.date, latitudes and longitudes are 
+ sequences of the same length in decimal degrees, one entry per place. 
+ timezone is the offset in hours, east is positive, None for the local 
+ offset. daytime is the part of the day the sun is calculated for. 
+ 
+ Returns three lists (sunrise, sunset, solarnoon), each holding a list 
+ of decimal days per place, in the order of dates. Sunrise and sunset 
+ are None on days the sun does not rise or set. 
+ """  
+ if timezone is None : timezone = local_tzoffset()  
+ zenith = cos(rad(90.833))  
+ tz = timezone*60  
+ 
+ # Per day: declination terms and the equation of time  
+ days = []  
+ for d in dates:  
+  declination,eqtime = solar_position(d.toordinal()-(734124-40529),daytime,timezone)  
+  days.append((cos(rad(declination)),tan(rad(declination)),eqtime))  
   
+ sunrise = []  
+ sunset = []  
+ solarnoon = []  
+ for latitude,longitude in zip(latitudes,longitudes):  
+  coslat = cos(rad(latitude))  
+  tanlat = tan(rad(latitude))  
+  base = 720-4*longitude  
+  rises = []  
+  sets = []  
+  noons = []  
+  for cosdecl,tandecl,eqtime in days:  
+   noon = (base-eqtime+tz)/1440  
+   x = zenith/(coslat*cosdecl)-tanlat*tandecl  
+   noons.append(noon)  
+   if -1 <= x <= 1:  
+    hourangle = deg(acos(x))  
+    rises.append(noon-hourangle*4/1440)  
+    sets.append(noon+hourangle*4/1440)  
+   else:  
+    rises.append(None)  
+    sets.append(None)  
+  sunrise.append(rises)  
+  sunset.append(sets)  
+  solarnoon.append(noons)  
+ return sunrise,sunset,solarnoon
+
 
+def decimal_day_seconds(day):  
+ """ whole seconds from midnight of a decimal day, truncated as sun does """  
+ hours  = 24.0*day  
+ h      = int(hours)  
+ minutes= (hours-h)*60  
+ m      = int(minutes)  
+ seconds= (minutes-m)*60  
+ return h*3600+m*60+int(seconds)
@@ -0,0 +1,52 @@
+import io
+import time
+import argparse
+from weather_landscape import WeatherLandscape
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Compare size and encode time of the animation formats')
+parser.add_argument('--white-bg', '-w', action='store_true', help='Use white background')
+parser.add_argument('--moon', '-m', action='store_true', help='Draw moon phase in the animation')
+parser.add_argument('--indexed', '-i', action='store_true', help='Render on a palette-indexed canvas')
+parser.add_argument('--repeat', '-n', type=int, default=5, help='Number of encodes per format (default: 5)')
+args = parser.parse_args()
+
+w = WeatherLandscape(
+    use_dynamic_bg=not args.white_bg,
+    use_white_bg=args.white_bg,
+    show_moon_phase=args.moon,
+    use_palette=args.indexed,
+    seed=1
+)
+
+# Every format encodes the same frames
+colors, frames = w.AnimatedFrames()
+frames = list(frames)
+
+
+def Measure(encode):
+    size = 0
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        f = io.BytesIO()
+        encode(f)
+        size = len(f.getvalue())
+    return size, (time.perf_counter() - t0) * 1000 / args.repeat
+
+
+def PillowGif(f):
+    # Plain Pillow save, as animations were written before the encoders
+    frames[0].save(f, format="GIF", save_all=True, append_images=frames[1:], optimize=False,
+                   duration=w.ANIMATION_DURATION, loop=0, disposal=2)
+
+
+results = [("gif (pillow)",) + Measure(PillowGif)]
+for fmt in w.AnimationFormats():
+    encoder = w.MakeAnimationEncoder(fmt)
+    results.append((fmt,) + Measure(lambda f: encoder.Write(frames, f, colors)))
+
+print("%d frames %dx%d, %d encodes each" % (len(frames), frames[0].width, frames[0].height, args.repeat))
+print("%-14s %10s %8s %10s" % ("format", "bytes", "ratio", "ms"))
+base = results[0][1]
+for fmt, size, ms in results:
+    print("%-14s %10d %7.2fx %10.1f" % (fmt, size, base / size, ms))
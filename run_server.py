@@ -19,6 +19,7 @@ SERV_PORT = 3355
 EINKFILENAME = "test.bmp"
 USERFILENAME = "test1.bmp"
 FAVICON = "favicon.ico"
+ANIMFILENAME = "animation"  # served as animation.gif, animation.webp, animation.png
 
 FILETOOOLD_SEC = 60*10
 
@@ -72,6 +73,10 @@ class WeatherLandscapeServer(BaseHTTPRequestHandler):
             file_name = WEATHER.TmpFilePath(self.path[1:])
             self.do_GET_sendfile(file_name ,"image/bmp")
             return
+
+        if (self.path.startswith('/'+ANIMFILENAME+'.')):
+            self.do_GET_animation(self.path[len(ANIMFILENAME)+1:].split('?')[0])
+            return
             
         print("Path not accessible:",self.path)
         self.send_response(403)
@@ -79,6 +84,21 @@ class WeatherLandscapeServer(BaseHTTPRequestHandler):
 
 
 
+    def do_GET_animation(self,ext:str):
+        # Frames are encoded straight into the response
+        for fmt in WEATHER.AnimationFormats():
+            if (WEATHER.ANIMATION_ENCODERS[fmt].EXT == ext):
+                encoder = WEATHER.MakeAnimationEncoder(fmt)
+                self.send_response(200)
+                self.send_header("Content-type", encoder.MIME)
+                self.end_headers()
+                WEATHER.WriteAnimation(self.wfile, fmt, encoder)
+                return
+        print("Animation format not supported:",ext)
+        self.send_response(404)
+        self.end_headers()
+
+
     def IsFileTooOld(self, filename):
         return (not os.path.isfile(filename)) or ( (time.time() - os.stat(filename).st_mtime) > FILETOOOLD_SEC )
 
@@ -109,6 +129,9 @@ class WeatherLandscapeServer(BaseHTTPRequestHandler):
         body = '<h1>Weather as Landscape</h1>'
         body+='<p>Place: '+("%.4f" % secrets.OWM_LAT) +' , '+("%.4f" % secrets.OWM_LON)+'</p>'
         body+='<p><img src="'+USERFILENAME+'" alt="Weather" "></p>'
+        for fmt in WEATHER.AnimationFormats():
+            ext = WEATHER.ANIMATION_ENCODERS[fmt].EXT
+            body+='<p><a href="'+ANIMFILENAME+ext+'">Animation ('+fmt.upper()+')</a></p>'
         body+='<p>ESP32 URL: <span id="eink"></span></p>'
         body+='<script> document.getElementById("eink").innerHTML = window.location+"'+EINKFILENAME+'" ;</script>'
             
@@ -10,6 +10,9 @@ parser.add_argument('--white-bg', '-w', action='store_true', help='Use white bac
 parser.add_argument('--black-bg', '-b', action='store_true', help='Use black background')
 parser.add_argument('--dynamic-bg', '-d', action='store_true', help='Use dynamic background that changes with time of day (default)')
 parser.add_argument('--moon', '-m', action='store_true', help='Draw moon phase in the animated GIF')
+parser.add_argument('--indexed', '-i', action='store_true', help='Render on a palette-indexed canvas')
+parser.add_argument('--workers', '-j', type=int, default=1, help='Number of processes drawing animation frames')
+parser.add_argument('--format', '-f', choices=WeatherLandscape.AnimationFormats(), default='gif', help='Animation format (default: gif)')
 args = parser.parse_args()
 
 # If no background option is specified, use dynamic background by default
@@ -21,13 +24,16 @@ w = WeatherLandscape(
     use_dynamic_bg=args.dynamic_bg,
     use_black_bg=args.black_bg,
     use_white_bg=args.white_bg,
-    show_moon_phase=args.moon
+    show_moon_phase=args.moon,
+    use_palette=args.indexed,
+    frame_workers=args.workers
 )
 
 # Generate either static image or animated GIF
 if args.animated:
-    fn = w.SaveAnimatedGif()
-    print("Saved animated GIF:", fn)
+    fn = w.SaveAnimation(args.format)
+    w.Close()
+    print("Saved animation:", fn)
 else:
     fn = w.SaveImage()
     print("Saved static image:", fn)
@@ -3,11 +3,16 @@ from PIL import Image
 import datetime
 from typing import Tuple
 import math
+import random
 
 from p_weather.openweathermap import OpenWeatherMap, OpenWeatherMapSettings
 from p_weather.sprites import Sprites
+from p_weather.layout_plan import LayoutPlan, Precipitation
 from p_weather.draw_weather import DrawWeather
-from p_weather.sunrise import sun
+from p_weather.frame_render import AnimationSession, FramePool
+from p_weather.gif_encoder import GifEncoder
+from p_weather.animation_encoder import WebPEncoder, ApngEncoder
+from p_weather.solar_almanac import SolarAlmanac
 
 import secrets
 
@@ -23,6 +28,9 @@ class WeatherLandscape:
     DRAWOFFSET = 65
     ANIMATION_FRAMES = 10  # Number of frames for animation
     ANIMATION_DURATION = 100  # Duration of each frame in milliseconds
+    ANIMATION_ENCODERS = {encoder.FORMAT: encoder for encoder in (GifEncoder, WebPEncoder, ApngEncoder)}
+    SMOKE_FRAMES = 4  # Number of frames when only smoke moves, played over the same loop period
+    SMOKE_ANIMATED = False  # Whether swaying smoke alone animates, dry days are a still image otherwise
     
     # Standard dimensions for all images
     WIDTH = 296
@@ -42,11 +50,15 @@ class WeatherLandscape:
     MOON_IMG = "pic/moon.png"
     MOON_PHASE_IMG = "tmp/moon_phase.png"
     MOON_TEXT = "tmp/moon.txt"
+    MOON_SAVE_FILES = False  # Also write MOON_PHASE_IMG and MOON_TEXT
+    MOON_PRECISE = False  # Compute the moon with the ephem package instead of the built-in ephemeris
     MOON_SIZE = 25  # Size of moon to display (25% of the original 40)
     MOON_Y_POS = 5  # Vertical position of the moon
 
+    ALMANAC_DAYS = 0  # Days of sun times tabulated ahead per location, 0 computes each day on first use
 
-    def __init__(self, use_dynamic_bg=True, use_black_bg=False, use_white_bg=False, show_moon_phase=False):
+
+    def __init__(self, use_dynamic_bg=True, use_black_bg=False, use_white_bg=False, show_moon_phase=False, seed=None, use_palette=False, frame_workers=1):
         """
         Initialize the weather landscape generator
         
@@ -55,6 +67,12 @@ class WeatherLandscape:
             use_black_bg: bool - Force black background (overrides dynamic)
             use_white_bg: bool - Force white background (overrides dynamic and black)
             show_moon_phase: bool - Show moon phase in the generated image/GIF
+            seed: int - Seed for the random layout of clouds and precipitation,
+                        None for a different layout on every render
+            use_palette: bool - Render on an indexed ("P") canvas and apply the colors
+                                as a palette, see ApplyPalette()
+            frame_workers: int - Number of processes drawing animation frames,
+                                 1 draws them in this process
         """
         assert secrets.OWM_KEY != "000000000000000000", "Set OWM_KEY variable to your OpenWeather API key in secrets.py"
         
@@ -62,6 +80,10 @@ class WeatherLandscape:
         self.use_black_bg = use_black_bg and not use_white_bg  # White overrides black
         self.use_white_bg = use_white_bg
         self.show_moon_phase = show_moon_phase
+        self.seed = seed
+        self.use_palette = use_palette
+        self.frame_workers = frame_workers
+        self.frame_pool = None
         
         # Initialize with default background - will be updated during render
         if self.use_white_bg:
@@ -76,33 +98,44 @@ class WeatherLandscape:
             self.process_moon_phase()
 
 
+    # Moon data of the current day, shared by all instances: (date, data)
+    _moon_day = None
+
+
     def process_moon_phase(self):
-        """Process moon phase image if moon display is enabled"""
+        """
+        Process moon phase image if moon display is enabled
+        
+        The moon data is computed once per calendar day and kept in memory, files
+        are only written with MOON_SAVE_FILES. Called on construction and before
+        every render, so long running servers follow the phase.
+        """
         try:
-            from p_weather.moon_func import process_moon_phase
-            
-            # Ensure tmp directory exists
-            os.makedirs(self.TMP_DIR, exist_ok=True)
-            
-            # Process moon phase and save the image
-            self.moon_data = process_moon_phase(
-                moonpath=self.MOON_IMG,
-                phasepath=self.MOON_PHASE_IMG,
-                textpath=self.MOON_TEXT
-            )
+            from p_weather.moon_func import moon_data, process_moon_phase, MoonPhaseAtlas
             
-            # Load the processed moon phase image
-            self.moon_phase_img = Image.open(self.MOON_PHASE_IMG).convert("RGBA")
+            today = datetime.date.today()
+            cached = WeatherLandscape._moon_day
+            if (cached is not None) and (cached[0] == today):
+                self.moon_data = cached[1]
+            elif self.MOON_SAVE_FILES:
+                # Ensure tmp directory exists
+                os.makedirs(self.TMP_DIR, exist_ok=True)
+                self.moon_data = process_moon_phase(
+                    moonpath=self.MOON_IMG,
+                    phasepath=self.MOON_PHASE_IMG,
+                    textpath=self.MOON_TEXT,
+                    precise=self.MOON_PRECISE
+                )
+                del self.moon_data["image"]
+            else:
+                self.moon_data = moon_data(precise=self.MOON_PRECISE)
+            WeatherLandscape._moon_day = (today, self.moon_data)
             
-            # Resize if needed (maintain aspect ratio)
-            width, height = self.moon_phase_img.size
-            ratio = width / height
-            new_width = self.MOON_SIZE
-            new_height = int(new_width / ratio)
-            self.moon_phase_img = self.moon_phase_img.resize((new_width, new_height), Image.LANCZOS)
+            # Phase image at display size (maintain aspect ratio), made once per 1% of phase
+            self.moon_phase_img = MoonPhaseAtlas.Get(self.MOON_IMG, self.MOON_SIZE).Phase(self.moon_data["phase"])
             
         except ImportError:
-            print("Warning: moon_func module not found. Moon phase will not be displayed.")
+            print("Warning: moon_func module or ephem package not found. Moon phase will not be displayed.")
             self.show_moon_phase = False
         except Exception as e:
             print(f"Error processing moon phase: {e}")
@@ -189,6 +222,62 @@ class WeatherLandscape:
         return (r, g, b)
 
 
+    def NewCanvas(self, bg_color: Tuple[int, int, int])->Image:
+        """
+        Create an empty canvas filled with the background
+        
+        Parameters:
+            bg_color: tuple - RGB background color, used directly by RGB canvases
+            
+        Returns:
+            Image: indexed canvas filled with Sprites.BACKGROUND if use_palette is set,
+                   RGB canvas otherwise
+        """
+        mode, background = self.CanvasFill(bg_color)
+        return Image.new(mode, (self.WIDTH, self.HEIGHT), color=background)
+
+
+    def CanvasFill(self, bg_color: Tuple[int, int, int])->tuple:
+        """Mode and background fill of new canvases: ("P", Sprites.BACKGROUND) or ("RGB", bg_color)"""
+        if self.use_palette:
+            return "P", Sprites.BACKGROUND
+        return "RGB", bg_color
+
+
+    def ApplyPalette(self, img: Image, bg_color: Tuple[int, int, int])->Image:
+        """
+        Color an indexed render for a background
+        
+        The render itself does not depend on the background, so the white, black and
+        dynamic variants of one indexed render differ only in the palette applied here.
+        
+        Parameters:
+            img: Image - indexed render, RGB images are returned unchanged
+            bg_color: tuple - RGB background color
+            
+        Returns:
+            Image: copy of img carrying the palette for bg_color
+        """
+        if img.mode != "P":
+            return img
+        img = img.copy()
+        img.putpalette(Sprites.MakePalette(self.is_dark_background(bg_color), bg_color))
+        return img
+
+
+    def SunTimes(self, owm, when:datetime.datetime)->tuple:
+        """
+        Sunrise and sunset on the day of when, from the almanac of the location
+
+        Returns:
+            tuple: (sunrise, sunset) as datetimes
+        """
+        almanac = SolarAlmanac.Get(owm.LAT, owm.LON)
+        if self.ALMANAC_DAYS and (almanac.table is None):
+            almanac.Precompute(days=self.ALMANAC_DAYS)
+        return almanac.Day(when)[:2]
+
+
     def MakeImage(self)->Image:
         """Create a single static weather landscape image"""
         cfg = OpenWeatherMapSettings.Fill(secrets, self.TMP_DIR)
@@ -197,18 +286,20 @@ class WeatherLandscape:
 
         # Get current time and sunrise/sunset times
         current_time = datetime.datetime.now()
-        s = sun(owm.LAT, owm.LON)
-        sunrise_time = s.sunrise(current_time)
-        sunset_time = s.sunset(current_time)
+        sunrise_time, sunset_time = self.SunTimes(owm, current_time)
+
+        # Moon of the current day
+        if self.show_moon_phase:
+            self.process_moon_phase()
 
         # Determine background color based on time of day
         bg_color = self.get_background_color(current_time, sunrise_time, sunset_time)
         
         # Create a fresh canvas with the determined background color
-        img = Image.new("RGB", (self.WIDTH, self.HEIGHT), color=bg_color)
+        img = self.NewCanvas(bg_color)
 
         # Initialize sprites
-        spr = Sprites(self.SPRITES_DIR, img)
+        spr = Sprites(self.SPRITES_DIR, img, seed=self.seed)
         
         # Adjust colors based on background brightness
         is_dark_bg = self.is_dark_background(bg_color)
@@ -216,6 +307,7 @@ class WeatherLandscape:
 
         art = DrawWeather(img, spr)
         art.Draw(self.DRAWOFFSET, owm, animate=False, frame_num=0, show_moon_phase=self.show_moon_phase)
+        img = self.ApplyPalette(img, bg_color)
 
         # Add moon phase if enabled
         if self.show_moon_phase and hasattr(self, 'moon_phase_img'):
@@ -292,44 +384,61 @@ class WeatherLandscape:
 
     def MakeAnimatedGif(self)->list:
         """Create an animated GIF of the weather landscape with rain and wind animations"""
+        _, frames = self.AnimatedFrames()
+        return list(frames)
+
+
+    def AnimatedFrames(self)->tuple:
+        """
+        Lay out an animation and draw its frames on demand
+        
+        Returns:
+            tuple: (palette, frames) - RGB colors of all frames for the encoder, and
+                   a generator drawing the frames one at a time
+        """
         cfg = OpenWeatherMapSettings.Fill(secrets, self.TMP_DIR)
         owm = OpenWeatherMap(cfg)
         owm.FromAuto()
         
         # Get current time and sunrise/sunset times
         current_time = datetime.datetime.now()
-        s = sun(owm.LAT, owm.LON)
-        sunrise_time = s.sunrise(current_time)
-        sunset_time = s.sunset(current_time)
+        sunrise_time, sunset_time = self.SunTimes(owm, current_time)
+
+        # Moon of the current day
+        if self.show_moon_phase:
+            self.process_moon_phase()
 
         # Determine background color based on time of day
         bg_color = self.get_background_color(current_time, sunrise_time, sunset_time)
         
         # Whether background is dark or light
         is_dark_bg = self.is_dark_background(bg_color)
-        
-        frames = []
+
+        # All frames share one seed so the random layout is the same in every frame
+        seed = self.seed if self.seed is not None else random.randrange(1 << 32)
         
         # Calculate moon position for sunset
         t = datetime.datetime.now()
         dt = datetime.timedelta(hours=3)  # Default time step
         sunset_pos_x = self.calculate_moon_position(t, sunset_time, dt, DrawWeather.XSTART, DrawWeather.XSTEP)
-        
-        for frame_num in range(self.ANIMATION_FRAMES):
-            # Create a fresh canvas for each frame with consistent dimensions and background color
-            img = Image.new("RGB", (self.WIDTH, self.HEIGHT), color=bg_color)
-            
-            # Initialize sprites with the current frame number for animation
-            spr = Sprites(self.SPRITES_DIR, img)
-            spr.current_frame = frame_num
-            spr.total_frames = self.ANIMATION_FRAMES
-            
-            # Adjust colors based on background brightness
-            spr.adjust_colors_for_background(is_dark_bg)
-            
-            # Draw the weather landscape
-            art = DrawWeather(img, spr)
-            art.Draw(self.DRAWOFFSET, owm, animate=True, frame_num=frame_num, show_moon_phase=self.show_moon_phase)
+
+        # Lay the landscape out once, every frame draws the same plan
+        canvas = self.NewCanvas(bg_color)
+        plan = DrawWeather(canvas, Sprites(self.SPRITES_DIR, canvas, seed=seed)).Layout(
+            self.DRAWOFFSET, owm, show_moon_phase=self.show_moon_phase)
+
+        # Only as many frames as the moving elements need
+        total_frames, duration = self.AnimationTiming(plan)
+
+        frames = self.IterAnimatedFrames(plan, bg_color, seed, is_dark_bg, total_frames, duration, sunset_pos_x)
+        return self.AnimationPalette(bg_color, is_dark_bg), frames
+
+
+    def IterAnimatedFrames(self, plan, bg_color, seed, is_dark_bg, total_frames, duration, sunset_pos_x):
+        """Generator of the finished frames of AnimatedFrames(), only one frame is made at a time"""
+        # The static layer is drawn once, rain and smoke of every frame on copies of it
+        for img in self.RenderFrames(plan, bg_color, seed, is_dark_bg, total_frames):
+            img = self.ApplyPalette(img, bg_color)
             
             # Add moon phase if enabled
             if self.show_moon_phase and hasattr(self, 'moon_phase_img'):
@@ -346,9 +455,89 @@ class WeatherLandscape:
                 # Convert back to RGB
                 img = img_rgba.convert("RGB")
             
-            frames.append(img)
+            img.info["duration"] = duration
+            yield img
+
+
+    def AnimationPalette(self, bg_color: Tuple[int, int, int], is_dark_bg: bool)->list:
+        """
+        Colors of every frame, known before any frame is drawn
         
-        return frames
+        Parameters:
+            bg_color: tuple - RGB background color
+            is_dark_bg: bool - whether the background is dark
+            
+        Returns:
+            list: RGB colors of the sprites, the background and the moon over the background
+        """
+        palette = Sprites.MakePalette(is_dark_bg, bg_color)
+        colors = [tuple(palette[3*i:3*i+3]) for i in range(Sprites.BACKGROUND + 1)]
+
+        if self.show_moon_phase and hasattr(self, 'moon_phase_img'):
+            moon = Image.new("RGB", self.moon_phase_img.size, bg_color)
+            moon.paste(self.moon_phase_img, (0, 0), self.moon_phase_img)
+            room = GifEncoder.COLORS_MAX - len(colors)
+            if moon.getcolors(room) is None:
+                moon = moon.quantize(room, dither=Image.Dither.NONE).convert("RGB")
+            colors += [color for _, color in moon.getcolors(room) if color not in colors]
+        return colors
+
+
+    def AnimationTiming(self, plan: LayoutPlan)->Tuple[int, int]:
+        """
+        Choose the frame count of an animation from what moves in it
+        
+        Rain needs all ANIMATION_FRAMES. Every landscape has chimney smoke, but it
+        only sways, so without rain it counts as moving only with SMOKE_ANIMATED and
+        then loops smoothly with SMOKE_FRAMES longer frames. Otherwise one still
+        frame is enough.
+        
+        Parameters:
+            plan: LayoutPlan - layout of the animation
+            
+        Returns:
+            tuple: (number of frames, duration of each frame in milliseconds)
+        """
+        loop_ms = self.ANIMATION_FRAMES * self.ANIMATION_DURATION
+        for item in plan.animated_items:
+            if isinstance(item, Precipitation) and Sprites.RainDropCount(item.value, item.width) > 0:
+                return self.ANIMATION_FRAMES, self.ANIMATION_DURATION
+        if self.SMOKE_ANIMATED and plan.smoke:
+            return self.SMOKE_FRAMES, loop_ms // self.SMOKE_FRAMES
+        return 1, loop_ms
+
+
+    def RenderFrames(self, plan, bg_color: Tuple[int, int, int], seed: int, is_dark_bg: bool, total_frames: int)->list:
+        """
+        Draw all animation frames of a plan with an AnimationSession
+        
+        With frame_workers above 1 the frames are drawn on a process pool that is
+        kept for later animations, see Close(). Both ways give the same frames.
+        
+        Parameters:
+            plan: LayoutPlan - layout shared by all frames
+            bg_color: tuple - RGB background color
+            seed: int - random seed shared by all frames
+            is_dark_bg: bool - whether the background is dark
+            total_frames: int - number of frames, see AnimationTiming()
+            
+        Returns:
+            iterator: frame canvases in frame order, drawn on demand
+        """
+        mode, background = self.CanvasFill(bg_color)
+        if (self.frame_workers > 1) and (total_frames > 1):
+            if self.frame_pool is None:
+                self.frame_pool = FramePool(self.SPRITES_DIR, self.frame_workers)
+            return self.frame_pool.Render(plan, mode, background, seed, is_dark_bg, total_frames)
+        session = AnimationSession(self.SPRITES_DIR, plan, mode, background, seed, is_dark_bg, total_frames)
+        return session.Frames()
+
+
+    def Close(self):
+        """Stop the frame worker processes, if any were started"""
+        if self.frame_pool is not None:
+            self.frame_pool.Close()
+            self.frame_pool = None
 
 
     def SaveImage(self)->str:
@@ -371,7 +560,20 @@ class WeatherLandscape:
 
     def SaveAnimatedGif(self)->str:
         """Save an animated weather landscape GIF"""
-        frames = self.MakeAnimatedGif()
+        return self.SaveAnimation("gif")
+
+
+    def SaveAnimation(self, fmt: str = "gif")->str:
+        """
+        Save an animated weather landscape
+        
+        Parameters:
+            fmt: str - animation format, one of AnimationFormats()
+            
+        Returns:
+            str: path of the saved file
+        """
+        encoder = self.MakeAnimationEncoder(fmt)
         placekey = OpenWeatherMap.MakePlaceKey(secrets.OWM_LAT, secrets.OWM_LON)
         
         # Determine filename suffix based on background mode
@@ -385,21 +587,65 @@ class WeatherLandscape:
         # Add moon indicator if moon phase is shown
         moon_indicator = "_moon" if self.show_moon_phase else ""
             
-        outfilepath = self.TmpFilePath(f"{self.OUT_FILENAME}{placekey}_{bg_indicator}{moon_indicator}{self.OUT_GIF_EXT}")
-        
-        # Save as animated GIF with consistent frame handling
-        frames[0].save(
-            outfilepath,
-            save_all=True,
-            append_images=frames[1:],
-            optimize=False,
-            duration=self.ANIMATION_DURATION,
-            loop=0,  # Loop forever
-            disposal=2  # Dispose previous frame to ensure background is preserved
-        )
+        outfilepath = self.TmpFilePath(f"{self.OUT_FILENAME}{placekey}_{bg_indicator}{moon_indicator}{encoder.EXT}")
+        
+        with open(outfilepath, "wb") as f:
+            self.WriteAnimation(f, fmt, encoder)
         
         return outfilepath
 
 
+    def WriteAnimatedGif(self, fp)->int:
+        """Stream an animated weather landscape GIF into a file object, see WriteAnimation()"""
+        return self.WriteAnimation(fp, "gif")
+
+
+    def WriteAnimation(self, fp, fmt: str = "gif", encoder=None)->int:
+        """
+        Encode an animated weather landscape into a file object
+        
+        GIF frames are drawn and encoded one at a time, so only the current and the
+        previous frame are in memory, and with a socket the first bytes leave
+        before the last frame is drawn. WebP and APNG collect the frames first.
+        
+        Parameters:
+            fp: file object opened for binary writing, e.g. an HTTP response stream
+            fmt: str - animation format, one of AnimationFormats()
+            encoder: AnimationEncoder - encoder to use instead of a new one for fmt
+            
+        Returns:
+            int: encoded size in bytes
+        """
+        if encoder is None:
+            encoder = self.MakeAnimationEncoder(fmt)
+        colors, frames = self.AnimatedFrames()
+        
+        # Shared palette, frames after the first store only the changed part
+        size = encoder.Write(frames, fp, colors)
+        print("%s: %d frames, %d bytes" % (encoder.FORMAT.upper(), encoder.encoded_frames, size))
+        return size
+
+
+    @classmethod
+    def AnimationFormats(cls)->list:
+        """Animation formats the installed Pillow can write"""
+        return [fmt for fmt, encoder in cls.ANIMATION_ENCODERS.items() if encoder.Available()]
+
+
+    def MakeAnimationEncoder(self, fmt: str):
+        """
+        Create the encoder of an animation format
+        
+        Parameters:
+            fmt: str - animation format, one of AnimationFormats()
+            
+        Returns:
+            AnimationEncoder: encoder looping forever with ANIMATION_DURATION frames
+        """
+        if fmt not in self.AnimationFormats():
+            raise ValueError("Unsupported animation format '%s', use one of: %s" % (fmt, ", ".join(self.AnimationFormats())))
+        return self.ANIMATION_ENCODERS[fmt](self.ANIMATION_DURATION, loop=0)
+
+
     def TmpFilePath(self,filename):
         return os.path.join(self.TMP_DIR,filename)
\ No newline at end of file